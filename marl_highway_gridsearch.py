@@ -48,6 +48,7 @@ run_config = {
          "epsilon_end": 0.1,
          "epsilon_end_time": 0.75,
          "num_evaluations": 10,
+         "num_envs": 1,
     },
     "eval": {
         "num_repetitions": 20,
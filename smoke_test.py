@@ -0,0 +1,27 @@
+from src.MOMA_DQN import MOMA_DQN
+import mo_gymnasium as mo_gym
+import itertools
+
+#minimal training and evaluation runs of MOMA_DQN on a small environment,
+#covering the single and multi dqn as well as training with one and several environments
+env_config = {
+    "vehicles_count": 4,
+    "controlled_vehicles": 3,
+    "duration": 5,
+}
+
+def run_smoke_test(use_multi_dqn: bool, num_envs: int):
+    env = mo_gym.make('moma-highway-env-v0', config=env_config)
+    agent = MOMA_DQN(env, seed=11, replay_buffer_size=100, batch_size=8, use_multi_dqn=use_multi_dqn)
+    loss_df = agent.train(num_episodes=4, inv_target_update_frequency=2, num_envs=num_envs)
+    assert len(loss_df) > 0
+    eval_df, vehicle_df = agent.evaluate(num_repetitions=1, num_points=2, seed=11)
+    assert len(eval_df) > 0 and len(vehicle_df) > 0
+
+def test_train_and_evaluate():
+    for use_multi_dqn, num_envs in itertools.product([False, True], [1, 3]):
+        run_smoke_test(use_multi_dqn, num_envs)
+
+if __name__ == "__main__":
+    test_train_and_evaluate()
+    print("smoke test passed")
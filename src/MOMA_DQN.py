@@ -1,4 +1,6 @@
 import gymnasium as gym
+import importlib.util
+from functools import partial
 from gymnasium.experimental.wrappers import RecordVideoV0
 import torch
 from torch import nn
@@ -7,13 +9,12 @@ import numpy as np
 from typing import Tuple, Sequence, Dict
 from src.utils import ReplayBuffer, random_objective_weights, DataLogger, LinearScalarisation
 from torch.nn.modules.loss import _Loss
-from tqdm import trange
+from tqdm import trange, tqdm
 from typing import List
-from pymoo.util.ref_dirs import get_reference_directions
 from DQN_Network import DQN_Network, Multi_DQN_Network
 import pandas as pd
 from copy import deepcopy
-from src.utils import calc_hypervolume
+from src.utils import calc_hypervolume, equally_spaced_weights
 from agent_display import InformationDisplay
 class MOMA_DQN:
     """ 
@@ -73,6 +74,18 @@ class MOMA_DQN:
         if self.device is None:
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+        #allow tf32 matmuls and let cudnn select the fastest kernels. On gpus supporting bfloat16, 
+        #the forward passes of the networks run under bfloat16 autocast while losses and optimiser states stay in float32
+        self.use_bf16_autocast = False
+        if self.device.type == "cuda":
+            torch.set_float32_matmul_precision('high')
+            torch.backends.cudnn.benchmark = True
+            self.use_bf16_autocast = torch.cuda.is_bf16_supported()
+
+        #persistent pinned staging buffers and a dedicated copy stream for host to device transfers (cuda only)
+        self.staging_buffers = {}
+        self.copy_stream = torch.cuda.Stream(self.device) if self.device.type == "cuda" else None
+
         self.num_objectives = num_objectives
         self.objective_weights = objective_weights
         if self.objective_weights is None:
@@ -83,25 +96,53 @@ class MOMA_DQN:
         #set proper observation space
         self.__configure_observation_space(observation_space_name, self.reward_structure)
 
+        #remember how to construct new instances of the environment (e.g. for evaluation)
+        self.env_spec_id = self.env.spec.id if self.env.spec is not None else None
+
         #determine observation space length
         obs, _ = self.env.reset()
-        obs = torch.tensor(obs[0], device=self.device) #reshape observations and
-        obs = obs[~torch.isnan(obs)].reshape(-1)       #remove nan values
-        self.observation_space_length = obs.shape[0]
+        obs = torch.tensor(obs[0], device=self.device).flatten()
+        #the position of the nan values only depends on the environment config, 
+        #so the indices of the remaining values are computed once and reused for every observation
+        self.obs_keep_idx = torch.nonzero(~torch.isnan(obs)).squeeze(1)
+        self.observation_space_length = self.obs_keep_idx.shape[0]
 
         #multi dqn method selection
         self.use_multi_dqn = use_multi_dqn
         if self.use_multi_dqn:
             self.update_weights_func = self.__update_weights_multi_DQN
+            self.compute_loss_func = self.__compile(self.__compute_loss_multi_DQN)
             self.act = self.__act_multi_DQN
 
         else:
             self.update_weights_func = self.__update_weights_single_DQN
+            self.compute_loss_func = self.__compile(self.__compute_loss_single_DQN)
             self.act = self.__act_single_DQN
 
+            #resolve how the ego and social rewards are combined in the loss once instead of at every weight update
+            reward_structure_funcs = {
+                "mean_reward": MOMA_DQN.__mean_reward_increased_ego_importance if self.increase_ego_reward_importance else MOMA_DQN.__mean_reward,
+                "ego_reward": MOMA_DQN.__ego_reward,
+            }
+            if reward_structure not in reward_structure_funcs:
+                raise ValueError('reward_structure argument not in list of available reward structures')
+            self.current_reward_func = reward_structure_funcs[reward_structure]
+
 
         (self.policy_net, self.target_net) = \
         self.__create_network(self.observation_space_length, self.num_actions, self.num_objectives)
+        #the networks contain neither dropout nor batch norm layers, so they are never switched between train and eval mode
+        self.__compile_networks()
+
+        #the social q values of the multi dqn are utilities, which are scalarised with weights of 1
+        self.social_objective_weights = torch.ones(self.num_objectives, device = self.device)
+        #reused for the joint actions during epsilon greedy action selection
+        self.joint_action_buffer = np.empty(self.num_controlled_vehicles, dtype=np.int64)
+        #the compiled action selection is always called with act_batch_size agents, smaller batches are padded in the act buffers.
+        #During training it is the number of controlled vehicles of all lockstep environments
+        self.act_batch_size = self.num_controlled_vehicles
+        self.act_obs_buffer = None
+        self.act_weights_buffer = None
 
         self.replay_enabled = replay_enabled
         self.rb_size = replay_buffer_size
@@ -113,6 +154,10 @@ class MOMA_DQN:
 
         #initialise scalarisation function
         self.scalarisation_method = scalarisation_method(*scalarisation_argument_list)
+        #the greedy mask only selects the agents that update the state of the chebyshev scalarisation, the linear scalarisation has no state
+        self.scalarisation_uses_greedy_mask = not isinstance(self.scalarisation_method, LinearScalarisation)
+        #the values of the actions are only copied to the host if they are shown by an information display
+        self.record_action_values = False
 
 
     def __create_network(self, num_observations, num_actions, num_objectives) -> Tuple[nn.Module, nn.Module]:
@@ -127,7 +172,59 @@ class MOMA_DQN:
             target_net.load_state_dict(policy_net.state_dict())
 
             return policy_net, target_net
+
+    def __compile(self, func):
+        '''compiles a network or function with torch.compile if the agent runs on a cuda device.
+        Small networks like the ones used here are dominated by launch overhead, which is removed by the captured cuda graphs.
+        Otherwise the function is returned unchanged.'''
+        if not self.__compile_supported():
+            return func
+        return torch.compile(func, mode="reduce-overhead", fullgraph=False)
+    
+    def __compile_supported(self) -> bool:
+        '''torch.compile is only used on cuda devices and needs triton to generate the kernels'''
+        return self.device.type == "cuda" and hasattr(torch, "compile") and importlib.util.find_spec("triton") is not None
+
+    def __trace(self, network: nn.Module) -> nn.Module:
+        '''traces the network with an example batch of observations to remove the python dispatch from its forward pass. 
+        The traced module shares its parameters with the network. If tracing fails, the network itself is returned'''
+        example_obs = torch.zeros(self.num_controlled_vehicles, self.observation_space_length, device=self.device)
+        try:
+            with torch.no_grad():
+                return torch.jit.trace(network, example_obs)
+        except Exception:
+            return network
+
+    def __autocast(self):
+        '''context for the forward passes of the networks. Their outputs have to be converted back to float32'''
+        return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16, enabled=self.use_bf16_autocast)
+
+    def __compile_networks(self):
+        '''creates the compiled versions of the networks. They share their parameters with the uncompiled networks, 
+        which are used for storing and loading the weights. If torch.compile is supported, only the policy net and the greedy action selection 
+        are compiled, as the networks used during the weight updates are compiled as part of the loss function.
+        Otherwise, the policy net and the target net are traced with torch.jit.trace.'''
+        if self.__compile_supported():
+            self.compiled_policy_net = self.__compile(self.policy_net)
+            self.compiled_target_net = self.target_net
+            #the forward pass, the scalarisation and the argmax of the single DQN action selection are compiled as one function,
+            #so that the whole action selection is a single captured graph instead of a graph followed by several small kernels.
+            #The compiled function doesn't modify the state of the scalarisation method, this is done by the caller
+            self.compiled_greedy_actions = self.__compile(partial(self.__greedy_actions, self.policy_net))
+        else:
+            self.compiled_policy_net = self.__trace(self.policy_net)
+            self.compiled_target_net = self.__trace(self.target_net)
+            self.compiled_greedy_actions = partial(self.__greedy_actions, self.compiled_policy_net)
     
+    def __make_env(self) -> gym.Env:
+        '''creates a new instance of the environment with the current configuration of the training environment. This is much cheaper
+        than a deepcopy of the training environment, which would also copy its entire simulation state.
+        Nested dictionaries of the config (e.g. the observation config) are copied, so that the new instance can't modify them'''
+        if self.env_spec_id is None: #environment wasn't created using gym.make
+            return deepcopy(self.env)
+        env_config = {key: deepcopy(value) if isinstance(value, dict) else value for key, value in self.env.unwrapped.config.items()}
+        return gym.make(self.env_spec_id, config=env_config, render_mode=self.env.unwrapped.render_mode)
+
     def __configure_observation_space(self, observation_space_name, reward_structure):
         # default observation dictionary to configure the environment with
         config_dict= {
@@ -156,12 +253,15 @@ class MOMA_DQN:
 
 
     def train(self, num_episodes: int = 5_000, inv_target_update_frequency: int = 20, gamma: float = 0.99, 
-              epsilon_start: float = 0.9, epsilon_end: float = 0, epsilon_end_time: float = 1, num_evaluations: int = 0, eval_seed: int = 11) :
+              epsilon_start: float = 0.9, epsilon_end: float = 0, epsilon_end_time: float = 1, num_evaluations: int = 0, eval_seed: int = 11,
+              num_envs: int = 1) :
         '''
         Runs the training procedure for num_iterations iterations. The inv_target_update_frequency specifies 
         the number of weight updates of the policy net, after which the target net weights are adjusted.
         Gamma is the discount factor for the rewards. Epsilon is the probability of a random action being selected during training.
         Its value is linearly reduced during the training procedure from epsilon_start to epsilon_end.
+        num_envs specifies the number of environment instances that are stepped in lockstep. The actions of the controlled vehicles 
+        of all instances are selected in one batch and their transitions are pushed to the replay buffer together.
         '''
         self.gamma = gamma
         #compute evaluation interval
@@ -170,90 +270,136 @@ class MOMA_DQN:
         
         #initialise loss logger
         feature_names = ["episode", "loss"]
-        self.loss_logger = DataLogger("loss_logger",feature_names)
+        self.loss_logger = DataLogger("loss_logger",feature_names, capacity=num_episodes)
 
         #initialise hv_logger
         feature_names = ["episode", "hypervolume", "avg_num_iterations_training", "std_num_iterations_training"]
-        hv_logger = DataLogger("hv_logger", feature_names)
+        hv_logger = DataLogger("hv_logger", feature_names, capacity=num_evaluations+1)
 
         self.epsilon = epsilon_start
-        self.optimiser = torch.optim.AdamW(self.policy_net.parameters(), lr=1e-4, amsgrad=True)
+        #on cuda, the fused implementation updates all parameters with a single kernel launch
+        self.optimiser = torch.optim.AdamW(self.policy_net.parameters(), lr=1e-4, amsgrad=True, fused=(self.device.type == "cuda"))
 
         self.loss_func = self.loss_criterion()
-        episode_nr = 0
         num_of_conducted_optimisation_steps = 0
         max_eps_iteration = round(num_episodes * epsilon_end_time)
 
+        #create additional environment instances, which are stepped in lockstep with the training environment
+        assert num_envs >= 1, "At least one training environment is required!"
+        num_envs = min(num_envs, num_episodes) #environments without an episode to run are not created
+        envs = [self.env] + [self.__make_env() for _ in range(num_envs - 1)]
+        env_infos = [None] * num_envs
+        env_episode_nrs = np.zeros(num_envs, dtype=np.int64) #episode number of the current episode of each environment
+        env_rows = [slice(k*self.num_controlled_vehicles, (k+1)*self.num_controlled_vehicles) for k in range(num_envs)]
+
+        #persistent device buffers for the observations and objective weights of the controlled vehicles of all environments.
+        #The rows env_rows[k] belong to environment k. The observation buffers are swapped after every step
+        obs_buffer = torch.empty((num_envs*self.num_controlled_vehicles, self.observation_space_length), device=self.device)
+        next_obs_buffer = torch.empty_like(obs_buffer)
+        objective_weights_buffer = torch.empty((num_envs*self.num_controlled_vehicles, self.num_objectives), device=self.device)
+        
+        active_envs = list(range(num_envs))
+        for k in active_envs:
+            env_infos[k] = self.__reset_training_env(envs[k], obs_buffer[env_rows[k]], objective_weights_buffer[env_rows[k]])
+            env_episode_nrs[k] = k
+        num_started_episodes = len(active_envs)
+        num_finished_episodes = 0
+
+        #auxiliary variables for loss logger. Each environment accumulates the losses of the weight updates during its current episode
+        env_weight_update_counters = np.zeros(num_envs, dtype=np.int64)
+        env_acc_losses = np.zeros(num_envs)
+        self.act_batch_size = num_envs*self.num_controlled_vehicles
+
         #training loop
-        for episode_nr in trange(num_episodes, desc="Training episodes", mininterval=2, position=3):
-            #reset auxiliary variables for loss logger
-            weight_update_counter = 0
-            acc_loss = 0
-
-            #reset environment
-            self.terminated = False
-            self.truncated = False
-            self.obs, info = self.env.reset()
-            self.obs = [torch.tensor(single_obs, device=self.device) for single_obs in self.obs] #reshape observations and
-            self.obs = [single_obs[~torch.isnan(single_obs)].reshape(1,-1) for single_obs in self.obs] #remove nan values
-
-            # currently every controlled vehicle has the same objective weights
-            self.objective_weights = random_objective_weights(self.num_objectives, self.rng, self.device)
-            for v in self.env.unwrapped.controlled_vehicles:
-                v.objective_weights = self.objective_weights     
-
-            while not (self.terminated or self.truncated):
-                num_close_vehicles = None
-                #self.env.render() #TODO: remove that line
-                if self.use_multi_dqn:
-                    num_close_vehicles = MOMA_DQN.__get_num_close_vehicles(info["vehicle_objective_weights"])
-                self.actions = self.act(self.obs, eps_greedy=True, num_close_vehicles=num_close_vehicles)
+        progress_bar = tqdm(total=num_episodes, desc="Training episodes", mininterval=2, position=3)
+        while len(active_envs) > 0:
+            #the rows of the active environments. Only once the last episodes are running, some environments are inactive
+            active_rows = None
+            if len(active_envs) < num_envs:
+                active_rows = np.concatenate([np.arange(env_rows[k].start, env_rows[k].stop) for k in active_envs])
+            self.obs = obs_buffer
+            self.objective_weights = objective_weights_buffer
+            num_close_vehicles = None
+            if self.use_multi_dqn:
+                num_close_vehicles = [n for k in range(num_envs) for n in MOMA_DQN.__get_num_close_vehicles(env_infos[k]["vehicle_objective_weights"])]
+            self.actions = self.act(self.obs, eps_greedy=True, num_close_vehicles=num_close_vehicles)
+
+            #execute the actions of the controlled vehicles in their environments
+            rewards, crashed, vehicle_obj_weights, finished_envs = [], [], [], []
+            for k in active_envs:
+                env_actions = self.actions[env_rows[k]]
                 if self.use_action_mapping:
-                    self.actions = tuple([MOMA_DQN.SINGE_LANE_ACTION_MAPPING[action] for action in self.actions])
+                    env_actions = tuple([MOMA_DQN.SINGE_LANE_ACTION_MAPPING[action] for action in env_actions])
                 (
-                    self.next_obs,
-                    self.rewards,
-                    self.terminated,
-                    self.truncated,
-                    info,
-                ) = self.env.step(self.actions)
-                self.crashed = info["crashed"]
-                vehicle_obj_weights = info["vehicle_objective_weights"]
-                
-                self.next_obs = [torch.tensor(single_obs, device=self.device) for single_obs in self.next_obs] #reshape observations and
-                self.next_obs = [single_obs[~torch.isnan(single_obs)].reshape(1,-1) for single_obs in self.next_obs] #remove nan values
-                
-                reward_summary = self.compute_reward_summary(self.rewards, vehicle_obj_weights)
-                
-                #re-map to an interval of 0 to n-1 for the network to train on
-                if self.use_action_mapping:
-                    self.actions = tuple([MOMA_DQN.SINGLE_LANE_REVERSE_ACTION_MAPPING[action] for action in self.actions])
-
-                self.buffer.push(self.obs, self.actions, self.next_obs, reward_summary, self.crashed, episode_nr, num_samples=self.num_controlled_vehicles)
-                
-                #use next_obs as obs during the next iteration
-                self.obs = self.next_obs
-                
-                #update weights if replay buffer is sufficiently filled
-                if (self.buffer.num_elements >= self.batch_size):
-                    loss = self.update_weights_func(episode_nr, num_of_conducted_optimisation_steps, inv_target_update_frequency)
-                    acc_loss += loss
-                    num_of_conducted_optimisation_steps += 1
-                    weight_update_counter += 1
+                    env_next_obs,
+                    env_rewards,
+                    terminated,
+                    truncated,
+                    env_infos[k],
+                ) = envs[k].step(env_actions)
+                self.__obs_to_tensor(env_next_obs, out=next_obs_buffer[env_rows[k]])
+                rewards.append(env_rewards)
+                crashed.extend(env_infos[k]["crashed"])
+                vehicle_obj_weights.extend(env_infos[k]["vehicle_objective_weights"])
+                if terminated or truncated:
+                    finished_envs.append(k)
+
+            self.next_obs = next_obs_buffer
+            self.crashed = crashed
+            reward_summary = self.compute_reward_summary(np.concatenate(rewards), vehicle_obj_weights)
+
+            #only the transitions of the active environments are stored. The actions are already in the interval of 0 to n-1
+            obs, next_obs, actions = self.obs, self.next_obs, self.actions
+            if active_rows is not None:
+                device_rows = torch.from_numpy(active_rows).to(self.device)
+                obs, next_obs = obs.index_select(0, device_rows), next_obs.index_select(0, device_rows)
+                actions = np.asarray(actions)[active_rows]
+            #the episode numbers are used as importance sampling ids
+            episode_nrs = np.repeat(env_episode_nrs[active_envs], self.num_controlled_vehicles)
+            self.buffer.push(obs, actions, next_obs, reward_summary, self.crashed, episode_nrs, num_samples=obs.shape[0])
             
-            if weight_update_counter != 0:
-                self.loss_logger.add(episode= episode_nr, loss=acc_loss / weight_update_counter)
-                
-            #run evaluation
-            if (num_evaluations != 0) and (episode_nr % eval_interval == 0):
-                summary_log_df,_, hv = self.evaluate(num_repetitions= 10, num_points= 10, hv_reference_point=np.array([0,0]),
-                                        seed = eval_seed)
-                mean_num_iters = summary_log_df["num_iterations"].mean()
-                std_num_iters = summary_log_df["num_iterations"].std()
-                hv_logger.add(episode=episode_nr, hypervolume=hv, avg_num_iterations_training = mean_num_iters, std_num_iterations_training= std_num_iters)
-
-            #update logger, reduce epsilon
-            self.reduce_epsilon(max_eps_iteration, epsilon_start, epsilon_end) #linearly reduce the value of epsilon
+            #update weights if replay buffer is sufficiently filled
+            if (self.buffer.num_elements >= self.batch_size):
+                loss = self.update_weights_func(num_finished_episodes, num_of_conducted_optimisation_steps, inv_target_update_frequency)
+                env_acc_losses[active_envs] += loss
+                env_weight_update_counters[active_envs] += 1
+                num_of_conducted_optimisation_steps += 1
+
+            #use next_obs as obs during the next iteration
+            obs_buffer, next_obs_buffer = next_obs_buffer, obs_buffer
+
+            for k in finished_envs:
+                #episodes are numbered in the order in which they finish
+                episode_nr = num_finished_episodes
+                if env_weight_update_counters[k] != 0:
+                    self.loss_logger.add(episode= episode_nr, loss=env_acc_losses[k] / env_weight_update_counters[k])
+                env_weight_update_counters[k] = 0
+                env_acc_losses[k] = 0
+                    
+                #run evaluation
+                if (num_evaluations != 0) and (episode_nr % eval_interval == 0):
+                    summary_log_df,_, hv = self.evaluate(num_repetitions= 10, num_points= 10, hv_reference_point=np.array([0,0]),
+                                            seed = eval_seed)
+                    mean_num_iters = summary_log_df["num_iterations"].mean()
+                    std_num_iters = summary_log_df["num_iterations"].std()
+                    hv_logger.add(episode=episode_nr, hypervolume=hv, avg_num_iterations_training = mean_num_iters, std_num_iterations_training= std_num_iters)
+
+                #update logger, reduce epsilon
+                self.reduce_epsilon(max_eps_iteration, epsilon_start, epsilon_end) #linearly reduce the value of epsilon
+                num_finished_episodes += 1
+                progress_bar.update(1)
+
+                #start a new episode or deactivate the environment once all episodes have been started
+                if num_started_episodes < num_episodes:
+                    env_infos[k] = self.__reset_training_env(envs[k], obs_buffer[env_rows[k]], objective_weights_buffer[env_rows[k]])
+                    env_episode_nrs[k] = num_started_episodes
+                    num_started_episodes += 1
+                else:
+                    active_envs.remove(k)
+
+        progress_bar.close()
+        for env in envs[1:]:
+            env.close()
 
         # copy the network weights to the target net one last time
         self.target_net.load_state_dict(self.policy_net.state_dict())
@@ -277,112 +423,181 @@ class MOMA_DQN:
 
         return df
     
-    def compute_reward_summary(self, rewards, obj_weights):
-        reward_summary = []
-
-        #iterate over each controlled vehicle
-        for i in range(self.num_controlled_vehicles):
-            r = torch.from_numpy(rewards[i]).to(self.device) #fetch associated rewards
+    def __reset_training_env(self, env: gym.Env, obs_out: torch.Tensor, objective_weights_out: torch.Tensor):
+        '''resets a training environment and assigns new random objective weights to its controlled vehicles.
+        The observations and objective weights of the controlled vehicles are written into obs_out and objective_weights_out'''
+        obs, info = env.reset()
+        self.__obs_to_tensor(obs, out=obs_out)
+
+        # currently every controlled vehicle of an environment has the same objective weights
+        objective_weights = random_objective_weights(self.num_objectives, self.rng, self.device)
+        for v in env.unwrapped.controlled_vehicles:
+            v.objective_weights = objective_weights
+        objective_weights_out.copy_(objective_weights)
+        return info
 
-            weights = torch.stack(obj_weights[i], dim=0).to(self.device) #fetch associated weights
-            weights[torch.all(weights == 0, dim=1)] = 1/self.num_objectives #where vehicles are not controlled, assume equal weights
-            
-            #when some of the closest vehicles are too far away from ego, they are not included in the weights
-            #thus we need to bring the rewards tensor to the same shape as the weights tensor
-            if r.shape[0] > weights.shape[0]:
-                assert torch.isnan(r[weights.shape[0]:]).all() #make sure all rewards beyond this point are nan
-                r = r[:weights.shape[0]] #remove all excess rows from r
-            
-            #in case of a crash, use crash penalty
-            if self.crashed[i]:
-                r[:] = r[0][0].clone() #if crashed, use crash penalty regardless of obj weights
-                weights[:] = 1/self.num_objectives
+    def compute_reward_summary(self, rewards, obj_weights):
+        '''computes the reward summary of all controlled vehicles at once. rewards has the shape 
+        (num_controlled_vehicles, max_num_close_vehicles, num_objectives), obj_weights contains a list of weights for each 
+        controlled vehicle and its close vehicles. Returns a tensor of shape (num_controlled_vehicles, num_objectives*2+1)'''
+        r = self.__to_device("rewards", rewards) #fetch associated rewards
+
+        #when some of the closest vehicles are too far away from ego, they are not included in the weights
+        #thus only the first len(weights) rows of each vehicle's rewards are valid, the remaining ones are nan
+        num_vehicles = np.array([len(weights) for weights in obj_weights])
+        valid_mask = np.arange(r.shape[1]) < num_vehicles.reshape(-1,1)
+        valid_mask = self.__to_device("valid_mask", valid_mask)
+
+        #fetch associated weights and bring them to the same shape as the rewards tensor
+        weights = torch.zeros_like(r)
+        weights[valid_mask] = torch.stack([w for vehicle_weights in obj_weights for w in vehicle_weights]).to(self.device, r.dtype)
+        weights = torch.where(torch.all(weights == 0, dim=2, keepdim=True), 1/self.num_objectives, weights) #where vehicles are not controlled, assume equal weights
+        
+        #in case of a crash, use crash penalty regardless of obj weights
+        crashed = self.__to_device("crashed", np.asarray(self.crashed, dtype=bool)).reshape(-1,1,1)
+        r = torch.where(crashed, r[:,0:1,0:1], r)
+        weights = torch.where(crashed, 1/self.num_objectives, weights)
 
-            weighted_reward = r * weights
+        weighted_reward = torch.where(valid_mask.unsqueeze(2), r * weights, 0.0)
 
-            ego_reward = r[0,:] #for ego vehicle: use reward instead of utility
-            
-            num_close_vehicles = 0
-            if weighted_reward.shape[0] > 1:
-                weighted_social_rewards = weighted_reward[1:,:]
-                num_close_vehicles = weighted_social_rewards.shape[0]
-                mean_weighted_social_reward = torch.sum(weighted_social_rewards,dim=0) / (num_close_vehicles)
-            else:
-                mean_weighted_social_reward = torch.tensor([0,0], device=self.device) #when no other vehicles are around the ego vehicle
+        ego_reward = r[:,0,:] #for ego vehicle: use reward instead of utility
+        
+        #mean social reward is 0 when no other vehicles are around the ego vehicle
+        num_close_vehicles = valid_mask.sum(dim=1, keepdim=True) - 1
+        mean_weighted_social_reward = torch.sum(weighted_reward[:,1:,:], dim=1) / num_close_vehicles.clamp(min=1)
+
+        # this means: in replay buffer, the first two elements in the reward are the ego reward 
+        # the next two are the mean social utility, the next two are the ego objective weights and 
+        # the last one is the number of close vehicles
+        return torch.hstack([ego_reward, mean_weighted_social_reward, num_close_vehicles.to(r.dtype)])
+    
+    def __obs_to_tensor(self, obs, out: torch.Tensor = None):
+        '''stacks the observations of all controlled vehicles into one array, moves it to the device with a single transfer
+        and removes the nan values of all agents at once. Returns a tensor of shape (num_controlled_vehicles, observation_space_length),
+        which is written into out if it is given'''
+        obs = self.__to_device("obs", np.stack(obs, axis=0))
+        #gather the non-nan values with the cached indices to avoid data dependent output shapes
+        if out is None:
+            return obs.flatten(1).index_select(1, self.obs_keep_idx)
+        return torch.index_select(obs.flatten(1), 1, self.obs_keep_idx, out=out)
+
+    def __to_device(self, name: str, array: np.ndarray) -> torch.Tensor:
+        '''moves a numpy array to the device. On cuda devices, the array is copied into a persistent pinned staging buffer,
+        which is transferred asynchronously on the copy stream. The current stream waits for the transfer before using the result'''
+        if self.copy_stream is None:
+            return torch.from_numpy(array).to(self.device)
+        
+        key = (name, array.shape, array.dtype)
+        if key not in self.staging_buffers:
+            self.staging_buffers[key] = (torch.from_numpy(array).pin_memory(), torch.cuda.Event())
+            pinned, copy_done = self.staging_buffers[key]
+        else:
+            pinned, copy_done = self.staging_buffers[key]
+            copy_done.synchronize() #the previous transfer out of the staging buffer has to finish before it is overwritten
+            np.copyto(pinned.numpy(), array)
 
-            # this means: in replay buffer, the first two elements in the reward are the ego reward 
-            # the next two are the mean social utility, the next two are the ego objective weights and 
-            # the last one is the number of close vehicles
-            num_close_vehicles = torch.tensor([num_close_vehicles], device= self.device)
-            stacked_rewards = torch.hstack([ego_reward, mean_weighted_social_reward, num_close_vehicles])
-            reward_summary.append(stacked_rewards)
+        with torch.cuda.stream(self.copy_stream):
+            tensor = pinned.to(self.device, non_blocking=True)
+            copy_done.record()
+        torch.cuda.current_stream(self.device).wait_stream(self.copy_stream)
+        tensor.record_stream(torch.cuda.current_stream(self.device))
+        return tensor
 
-        return reward_summary
-    
     def __get_num_close_vehicles(vehicle_obj_weights):
         return [len(obj_weights) - 1 for obj_weights in vehicle_obj_weights] # -1 because the array includes the ego vehicle
 
     def __update_weights_single_DQN(self, current_iteration, current_optimisation_iteration, inv_target_update_frequency):
-        self.policy_net.train()
         #fetch samples from replay buffer
-        batch_samples = self.buffer.sample(self.batch_size)
-        observations = self.buffer.get_observations(batch_samples)
-        next_obs = self.buffer.get_next_obs(batch_samples)
-        actions = self.buffer.get_actions(batch_samples)
+        batch = self.buffer.sample_batch(self.batch_size)
+        observations = batch["observations"]
+        next_obs = batch["next_obs"]
+        actions = batch["actions"]
         actions = actions[:,0:self.num_objectives,:]
-        term_flags = self.buffer.get_termination_flag(batch_samples)
-        rewards  = self.buffer.get_rewards(batch_samples)
+        term_flags = batch["termination_flags"]
+        rewards  = batch["rewards"]
 
+        #compute loss between estimates and actual values
+        loss = self.compute_loss_func(observations, next_obs, actions, term_flags, rewards)
+
+        #backpropagate loss
+        self.optimiser.zero_grad()
+        loss.backward()
+        torch.nn.utils.clip_grad_value_(self.policy_net.parameters(), 100, foreach=(self.device.type == "cuda"))
+        self.optimiser.step()
+
+        #update the target networks
+        if (current_optimisation_iteration % inv_target_update_frequency) == 0:
+                self.target_net.load_state_dict(self.policy_net.state_dict())
+
+        return loss.item()
+
+    def __compute_loss_single_DQN(self, observations, next_obs, actions, term_flags, rewards):
+        '''computes the loss between the q estimates of the policy net and the (double) DQN targets.
+        It only consists of tensor operations, so that it can be compiled as a single graph'''
         #fetch Q values of the current observation and action from all the objectives Q-networks
-        state_action_values = self.policy_net(observations)
-        state_action_values = state_action_values.gather(2, actions)
+        with self.__autocast():
+            state_action_values = self.policy_net(observations)
+        state_action_values = state_action_values.float().gather(2, actions)
         state_action_values = state_action_values.reshape(observations.shape[0],self.num_objectives)
 
-        with torch.no_grad():
+        with torch.inference_mode(), self.__autocast():
             #code taken from https://github.com/eleurent/rl-agents/blob/master/rl_agents/agents/deep_q_network/pytorch.py
             if self.use_double_q_learning:
                 best_actions_policy_net = self.policy_net(next_obs).argmax(2).unsqueeze(2)
-                target_net_estimate = self.target_net(next_obs)
+                target_net_estimate = self.compiled_target_net(next_obs)
                 next_state_values = target_net_estimate.gather(2, best_actions_policy_net).squeeze(2)
             else:
-                next_state_values = self.target_net(next_obs).max(2).values
+                next_state_values = self.compiled_target_net(next_obs).max(2).values
+        next_state_values = next_state_values.float()
 
-        next_state_values[term_flags] = 0 #set to 0 in case of a crash
+        #set to 0 in case of a crash. Outside of inference mode, this creates a normal tensor that can be saved for backward
+        next_state_values = torch.where(term_flags.unsqueeze(-1), 0.0, next_state_values)
 
-                
         ego_rewards = rewards[:,0:self.num_objectives]
         mean_weighted_social_rewards = rewards[:,self.num_objectives:-1]
         num_close_vehicles = rewards[:,-1]
 
-        current_reward = None
-        match self.reward_structure:
-            case "mean_reward":
-                mean_social_utility = torch.sum(mean_weighted_social_rewards, dim = 1)
-
-                if self.increase_ego_reward_importance:
-                    social_utility = mean_social_utility.reshape(-1,1)
-                    social_utility = torch.hstack([social_utility, social_utility])
-                    current_reward = ((ego_rewards + social_utility)/2)
-                else:
-                    social_utility = mean_social_utility*num_close_vehicles
-                    social_utility = social_utility.reshape(-1,1)
-                    social_utility = torch.hstack([social_utility, social_utility])
-                    current_reward = (ego_rewards + social_utility)
-                    current_reward = current_reward/(num_close_vehicles+1).reshape(-1,1)
-            case "ego_reward":
-                current_reward = ego_rewards #only select reward of ego vehicle
-            case _:
-                raise ValueError('reward_structure argument not in list of available reward structures')
+        current_reward = self.current_reward_func(ego_rewards, mean_weighted_social_rewards, num_close_vehicles)
 
         exp_state_action_values = next_state_values * self.gamma + current_reward
 
+        return self.loss_func(state_action_values, exp_state_action_values)
+
+    def __mean_reward(ego_rewards, mean_weighted_social_rewards, num_close_vehicles):
+        '''mean of the ego reward and the social utilities of all close vehicles'''
+        social_utility = torch.sum(mean_weighted_social_rewards, dim = 1)*num_close_vehicles
+        social_utility = social_utility.reshape(-1,1)
+        social_utility = torch.hstack([social_utility, social_utility])
+        current_reward = (ego_rewards + social_utility)
+        return current_reward/(num_close_vehicles+1).reshape(-1,1)
+    
+    def __mean_reward_increased_ego_importance(ego_rewards, mean_weighted_social_rewards, num_close_vehicles):
+        '''places a 50% importance on the ego reward and the remaining 50% on the mean social utility'''
+        social_utility = torch.sum(mean_weighted_social_rewards, dim = 1).reshape(-1,1)
+        social_utility = torch.hstack([social_utility, social_utility])
+        return ((ego_rewards + social_utility)/2)
+    
+    def __ego_reward(ego_rewards, mean_weighted_social_rewards, num_close_vehicles):
+        '''only select reward of ego vehicle'''
+        return ego_rewards
+
+    def __update_weights_multi_DQN(self, current_iteration, current_optimisation_iteration, inv_target_update_frequency):
+        #fetch samples from replay buffer
+        batch = self.buffer.sample_batch(self.batch_size)
+        observations = batch["observations"]
+        next_obs = batch["next_obs"]
+        actions = batch["actions"]
+        actions = actions[:,0:self.num_objectives*2,:] #*2 because we have two DQN networks (ego and social)
+        term_flags = batch["termination_flags"]
+        rewards  = batch["rewards"]
+
         #compute loss between estimates and actual values
-        loss = self.loss_func(state_action_values, exp_state_action_values)
+        loss = self.compute_loss_func(observations, next_obs, actions, term_flags, rewards)
 
         #backpropagate loss
         self.optimiser.zero_grad()
         loss.backward()
-        torch.nn.utils.clip_grad_value_(self.policy_net.parameters(), 100)
+        torch.nn.utils.clip_grad_value_(self.policy_net.parameters(), 100, foreach=(self.device.type == "cuda"))
         self.optimiser.step()
 
         #update the target networks
@@ -391,25 +606,18 @@ class MOMA_DQN:
 
         return loss.item()
 
-    def __update_weights_multi_DQN(self, current_iteration, current_optimisation_iteration, inv_target_update_frequency):
-        self.policy_net.train()
-        #fetch samples from replay buffer
-        batch_samples = self.buffer.sample(self.batch_size)
-        observations = self.buffer.get_observations(batch_samples)
-        next_obs = self.buffer.get_next_obs(batch_samples)
-        actions = self.buffer.get_actions(batch_samples)
-        actions = actions[:,0:self.num_objectives*2,:] #*2 because we have two DQN networks (ego and social)
-        term_flags = self.buffer.get_termination_flag(batch_samples)
-        rewards  = self.buffer.get_rewards(batch_samples)
-
+    def __compute_loss_multi_DQN(self, observations, next_obs, actions, term_flags, rewards):
+        '''computes the loss between the q estimates of the ego and social networks and their (double) DQN targets.
+        It only consists of tensor operations, so that it can be compiled as a single graph'''
         #fetch Q values of the current observation and action from all the objectives Q-networks
-        state_action_values = self.policy_net(observations)
-        state_action_values = torch.swapaxes(state_action_values, 0, 1)
+        with self.__autocast():
+            state_action_values = self.policy_net(observations)
+        state_action_values = torch.swapaxes(state_action_values.float(), 0, 1)
         state_action_values = torch.flatten(state_action_values, start_dim=1, end_dim=2)
         state_action_values = state_action_values.gather(2, actions)
         state_action_values = state_action_values.reshape(observations.shape[0],2,self.num_objectives) #2 because we have two DQN networks (ego and social)
 
-        with torch.no_grad():
+        with torch.inference_mode(), self.__autocast():
             #code taken from https://github.com/eleurent/rl-agents/blob/master/rl_agents/agents/deep_q_network/pytorch.py
             if self.use_double_q_learning:
                 #fetch best actions from policy net
@@ -418,111 +626,143 @@ class MOMA_DQN:
                 best_actions = policy_obs.argmax(3).unsqueeze(3)
 
                 #get target net estimate for best actions as next state values
-                target_net_estimate = self.target_net(next_obs)
+                target_net_estimate = self.compiled_target_net(next_obs)
                 target_net_estimate = torch.swapaxes(target_net_estimate, 0, 1)
                 next_state_values = target_net_estimate.gather(3, best_actions).squeeze(3)
             else:
-                target_net_estimate = self.target_net(next_obs)
+                target_net_estimate = self.compiled_target_net(next_obs)
                 target_net_estimate = torch.swapaxes(target_net_estimate, 0, 1)
                 next_state_values = target_net_estimate.max(3).values
+        next_state_values = next_state_values.float()
 
-        next_state_values[term_flags] = 0 #set to 0 in case of a crash
+        #set to 0 in case of a crash. Outside of inference mode, this creates a normal tensor that can be saved for backward
+        next_state_values = torch.where(term_flags.reshape(-1,1,1), 0.0, next_state_values)
 
         ego_rewards = rewards[:,0:self.num_objectives]
         mean_weighted_social_rewards = rewards[:,self.num_objectives:-1]
-        num_close_vehicles = rewards[:,-1]
 
         # Multi_DQN only works with the mean reward structure and doesn't require us to merge the two rewards together
         current_reward = torch.stack([ego_rewards, mean_weighted_social_rewards], dim=1)
 
         exp_state_action_values = next_state_values * self.gamma + current_reward
 
-        #compute loss between estimates and actual values
-        loss = self.loss_func(state_action_values, exp_state_action_values)
-
-        #backpropagate loss
-        self.optimiser.zero_grad()
-        loss.backward()
-        torch.nn.utils.clip_grad_value_(self.policy_net.parameters(), 100)
-        self.optimiser.step()
-
-        #update the target networks
-        if (current_optimisation_iteration % inv_target_update_frequency) == 0:
-                self.target_net.load_state_dict(self.policy_net.state_dict())
-
-        return loss.item()
+        return self.loss_func(state_action_values, exp_state_action_values)
     
     def __act_single_DQN(self, obs, eps_greedy: bool = False, num_close_vehicles: List[int] = None):
         '''select a list of actions, one element for each autonomously controlled agent.
+        The observations of all agents are passed through the policy net as one batch.
         num_close_vehicles parameter was added to create a uniform function header irrespective of used network structure'''
-        joint_action = []
-        for i, single_obs in enumerate(obs):
-            r = self.rng.random()
-            action = None
-
-            #select best action according to policy
-            if not eps_greedy or r > self.epsilon:
-                with torch.no_grad():
-                    self.policy_net.eval()
-                    q_values = self.policy_net(single_obs)
-                    q_values = q_values.reshape(self.num_objectives, self.num_actions)
-                    scalarised_values = self.scalarisation_method.scalarise_actions(q_values, self.objective_weights)
-                    action = torch.argmax(scalarised_values).item()
-                    
-                    #attributes for information display for observer vehicle
-                    if i == 0:
-                        self.action_utility_values = scalarised_values.cpu().numpy()
-                        self.action_q_values = q_values.cpu().numpy()
-
-            else: # choose random action
-                action = self.rng.choice(self.num_actions)
-
-            joint_action.append(action)
-
-        return tuple(joint_action)
+        num_agents = obs.shape[0]
+        random_mask = self.__draw_random_mask(num_agents, eps_greedy)
+        with torch.inference_mode():
+            obs, objective_weights, greedy_mask = self.__pad_act_batch(obs, self.objective_weights, random_mask)
+            q_values, scalarised_values, greedy_actions, scalarisation_state = self.compiled_greedy_actions(obs, objective_weights, greedy_mask)
+            #the state of the scalarisation method is updated outside of the compiled function
+            self.scalarisation_method.update_state(scalarisation_state)
+            greedy_actions = greedy_actions[:num_agents].cpu().numpy()
+
+            #attributes for information display for observer vehicle
+            if self.record_action_values:
+                self.action_utility_values = scalarised_values[0].cpu().numpy()
+                self.action_q_values = q_values[0].cpu().numpy()
+
+        return self.__select_eps_greedy_actions(greedy_actions, random_mask)
+    
+    def __greedy_actions(self, network: nn.Module, obs: torch.Tensor, objective_weights: torch.Tensor, greedy_mask: torch.Tensor = None) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        '''returns the q values, the scalarised q values and the greedy action of each agent for a single DQN network, 
+        as well as the new state of the scalarisation method, which only includes the agents in greedy_mask. 
+        The state isn't applied here, so that this function has no side effects and can be compiled'''
+        num_agents = obs.shape[0]
+        with self.__autocast():
+            q_values = network(obs)
+        q_values = q_values.float().view(num_agents, self.num_objectives, self.num_actions)
+        scalarised_values, scalarisation_state = self.scalarisation_method.scalarise_actions_batched_stateless(q_values, objective_weights, greedy_mask)
+        return q_values, scalarised_values, torch.argmax(scalarised_values, dim=1), scalarisation_state
     
     #TODO: adjust this method to work with the MULTI-DQN 
     # (apply obj weights to ego reward to get utility, sum with mean_social_utility * num_close vehicles 
     # (get this from the newly created function))
     def __act_multi_DQN(self, obs, eps_greedy: bool = False, num_close_vehicles: List[int] = None):
-        '''select a list of actions, one element for each autonomously controlled agent'''
+        '''select a list of actions, one element for each autonomously controlled agent.
+        The observations of all agents are passed through the policy net as one batch.'''
         assert num_close_vehicles != None, "num_close_vehicles must not be none!"
         
-        joint_action = []
-        for i, single_obs in enumerate(obs):
-            r = self.rng.random()
-            action = None
-
-            #select best action according to policy
-            if not eps_greedy or r > self.epsilon:
-                with torch.no_grad():
-                    self.policy_net.eval()
-                    q_values = self.policy_net(single_obs)
-                    q_values_ego = q_values[0,:].reshape(self.num_objectives, self.num_actions)
-                    q_values_social = q_values[1,:].reshape(self.num_objectives, self.num_actions)
-
-                    scalarised_ego_values = self.scalarisation_method.scalarise_actions(q_values_ego, self.objective_weights)
-                    #the social neural network q value predictions are based on utility rather than the rewards, 
-                    # which means that they don't have to be weighted, thus objective weights of 1 are given to the scalarisation function
-                    scalarised_mean_social_values = self.scalarisation_method.scalarise_actions(q_values_social, torch.tensor([1]*self.num_objectives, device = self.device))
-                    
-                    #take action based on mean scalarised values
-                    if self.increase_ego_reward_importance:
-                        scalarised_values = (scalarised_ego_values + scalarised_mean_social_values)/2
-                    else:
-                        scalarised_values = (scalarised_ego_values + (scalarised_mean_social_values * num_close_vehicles[i])) / num_close_vehicles[i] + 1
-                    action = torch.argmax(scalarised_values).item()
-
-                    #attributes for information display for observer vehicle
-                    if i == 0:
-                        self.action_utility_values = scalarised_values.cpu().numpy()
-
-            else: # choose random action
-                action = self.rng.choice(self.num_actions)
-
-            joint_action.append(action)
+        num_agents = obs.shape[0]
+        random_mask = self.__draw_random_mask(num_agents, eps_greedy)
+        with torch.inference_mode():
+            obs, objective_weights, greedy_mask = self.__pad_act_batch(obs, self.objective_weights, random_mask)
+            batch_size = obs.shape[0]
+            with self.__autocast():
+                q_values = self.compiled_policy_net(obs).float()
+            q_values_ego = q_values[0].view(batch_size, self.num_objectives, self.num_actions)
+            q_values_social = q_values[1].view(batch_size, self.num_objectives, self.num_actions)
+
+            scalarised_ego_values = self.scalarisation_method.scalarise_actions_batched(q_values_ego, objective_weights, greedy_mask)
+            #the social neural network q value predictions are based on utility rather than the rewards, 
+            # which means that they don't have to be weighted, thus objective weights of 1 are given to the scalarisation function
+            scalarised_mean_social_values = self.scalarisation_method.scalarise_actions_batched(q_values_social, self.social_objective_weights, greedy_mask)
+            
+            #take action based on mean scalarised values
+            if self.increase_ego_reward_importance:
+                scalarised_values = (scalarised_ego_values + scalarised_mean_social_values)/2
+            else:
+                #the padding rows are divided by 1
+                num_close_vehicles = list(num_close_vehicles) + [1] * (batch_size - num_agents)
+                num_close_vehicles = torch.tensor(num_close_vehicles, device=self.device).reshape(-1,1)
+                scalarised_values = (scalarised_ego_values + (scalarised_mean_social_values * num_close_vehicles)) / num_close_vehicles + 1
+            greedy_actions = torch.argmax(scalarised_values[:num_agents], dim=1).cpu().numpy()
+
+        #attributes for information display for observer vehicle
+        if self.record_action_values:
+            self.action_utility_values = scalarised_values[0].cpu().numpy()
+
+        return self.__select_eps_greedy_actions(greedy_actions, random_mask)
+
+    def __draw_random_mask(self, num_agents: int, eps_greedy: bool) -> np.ndarray:
+        '''returns a boolean array marking the agents that take a random action, each with probability epsilon. 
+        It is drawn before the greedy actions are computed, so that only greedy agents update the scalarisation method. None if eps_greedy isn't set'''
+        if not eps_greedy:
+            return None
+        return self.rng.random(num_agents) <= self.epsilon
+    
+    def __pad_act_batch(self, obs: torch.Tensor, objective_weights: torch.Tensor, random_mask: np.ndarray):
+        '''pads the batch of agents to act_batch_size rows, so that the compiled action selection is called with the same shapes 
+        during training and evaluation. Returns the observations, the objective weights of shape (act_batch_size, num_objectives) 
+        and the device mask of the agents that act greedily, which excludes the padding rows. 
+        The mask is None if the scalarisation method doesn't use it, otherwise it is always passed, so that the compiled function has a single variant'''
+        num_agents = obs.shape[0]
+        batch_size = max(self.act_batch_size, num_agents)
+        greedy_mask = None
+        if self.scalarisation_uses_greedy_mask:
+            greedy_mask = np.zeros(batch_size, dtype=bool)
+            greedy_mask[:num_agents] = True if random_mask is None else ~random_mask
+            greedy_mask = torch.from_numpy(greedy_mask).to(self.device)
+
+        if num_agents == batch_size and objective_weights.shape == (batch_size, self.num_objectives):
+            return obs, objective_weights, greedy_mask
+        
+        if self.act_obs_buffer is None or self.act_obs_buffer.shape[0] != batch_size:
+            self.act_obs_buffer = torch.zeros((batch_size, self.observation_space_length), device=self.device)
+            self.act_weights_buffer = torch.zeros((batch_size, self.num_objectives), device=self.device)
+        self.act_obs_buffer[:num_agents].copy_(obs)
+        #weights shared by all agents are broadcast to their rows
+        self.act_weights_buffer[:num_agents].copy_(objective_weights.reshape(-1, self.num_objectives))
+        return self.act_obs_buffer, self.act_weights_buffer, greedy_mask
+
+    def __select_eps_greedy_actions(self, greedy_actions: np.ndarray, random_mask: np.ndarray):
+        '''replaces the greedy action of each agent in random_mask with a random action. The greedy actions are kept if random_mask is None'''
+        if random_mask is None:
+            return tuple(greedy_actions.tolist())
+        
+        num_agents = greedy_actions.shape[0]
+        if self.joint_action_buffer.shape[0] < num_agents:
+            self.joint_action_buffer = np.empty(num_agents, dtype=np.int64)
+        joint_action = self.joint_action_buffer[:num_agents]
 
-        return tuple(joint_action)
+        random_actions = self.rng.integers(0, self.num_actions, size=num_agents)
+        np.copyto(joint_action, greedy_actions)
+        np.copyto(joint_action, random_actions, where=random_mask)
+        return tuple(joint_action.tolist())
 
     def evaluate(self, num_repetitions: int = 5, num_points: int = 20, hv_reference_point: np.ndarray = None, seed: int = None, episode_recording_interval: int = None, video_name_prefix: str = "MOMA_DQN", video_location: str = "videos", render_episodes: bool = False):
         """ Evaluates the performance of the trained network by conducting num_repetitions episodes for each objective weights tuple. 
@@ -533,7 +773,7 @@ class MOMA_DQN:
             to obtain a less biased result.
             The hv_reference_point is a vector specifying the best possible vectorial reward vector."""
         
-        self.eval_env = deepcopy(self.env)
+        self.eval_env = self.__make_env()
         self.rng = np.random.default_rng(seed)
         self.eval_env.unwrapped.configure({"rng": self.rng, "set_uncontrolled_obj_weights": self.estimate_uncontrolled_obj_weights})
 
@@ -543,31 +783,38 @@ class MOMA_DQN:
             #display additional information during rendering
             info_display = InformationDisplay(self.eval_env, self)
             self.eval_env.viewer.set_agent_display(info_display.display_meta_information)
+            self.record_action_values = True
 
         if episode_recording_interval is not None:
             self.eval_env = RecordVideoV0(self.eval_env, video_folder= video_location, name_prefix= video_name_prefix, 
                                                 episode_trigger=lambda x: x % episode_recording_interval == 0, fps=10)
 
         #get equally spaced objective weights
-        objective_weights = get_reference_directions("energy", n_dim = self.num_objectives, n_points = num_points, seed=seed)
-        objective_weights = torch.from_numpy(objective_weights).to(self.device)
+        objective_weights = equally_spaced_weights(self.num_objectives, num_points, seed)
+        objective_weights = torch.from_numpy(objective_weights).to(self.device) #single transfer of all weight tuples
         
-        #instantiate data loggers
+        #instantiate data loggers with a capacity of the maximum number of entries
+        num_episodes = objective_weights.shape[0] * num_repetitions
+        env_config = self.eval_env.unwrapped.config
+        max_num_iterations = int(env_config["duration"] * env_config["policy_frequency"])
+        num_vehicles = env_config["vehicles_count"] + env_config["controlled_vehicles"]
+
         #for summary information
         feature_names = ["repetition_number", "weight_index","weight_tuple", "num_iterations", "vehicle_id"]
         feature_names.extend([f"normalised_{x}" for x in self.objective_names])
         feature_names.extend([f"raw_{x}" for x in self.objective_names])
-        eval_logger = DataLogger("evaluation_logger",feature_names)
+        eval_logger = DataLogger("evaluation_logger",feature_names, capacity=num_episodes * self.num_controlled_vehicles)
 
         #for more detailed information on the individual vehicles
         #target and actual speeds are only useful for uncontrolled vehicles, while weights are only applicable to controlled vehicles
         feature_names = ["repetition_number", "weight_index", "weight_tuple", "iteration", "vehicle_id", "controlled_flag", "action", "target_speed", "curr_speed", "acc", "lane", "x_pos"]
         feature_names.extend([f"curr_{x}" for x in self.objective_names])
-        vehicle_logger = DataLogger("vehicle_logger", feature_names)
+        vehicle_logger = DataLogger("vehicle_logger", feature_names, capacity=num_episodes * max_num_iterations * num_vehicles)
         
         for tuple_index in trange(objective_weights.shape[0], desc="Weight tuple", mininterval=1, position=3):
             weight_tuple = objective_weights[tuple_index]
             self.objective_weights = weight_tuple
+            weight_list = weight_tuple.tolist()
 
             for repetition_nr in range(num_repetitions):
                 self.terminated = False
@@ -584,8 +831,7 @@ class MOMA_DQN:
                     if render_episodes:
                         self.eval_env.render()
                     #select action based on obs. Execute action, add up reward, next iteration
-                    self.obs = [torch.tensor(single_obs, device=self.device) for single_obs in self.obs] #reshape observations and
-                    self.obs = [single_obs[~torch.isnan(single_obs)].reshape(1,-1) for single_obs in self.obs] #remove nan values
+                    self.obs = self.__obs_to_tensor(self.obs)
                     num_close_vehicles = None
                     if self.use_multi_dqn:
                         num_close_vehicles = MOMA_DQN.__get_num_close_vehicles(info["vehicle_objective_weights"])
@@ -607,27 +853,33 @@ class MOMA_DQN:
                         accumulated_reward[vehicle_id] += vehicle_rewards
                     
 
-                    #populate vehicle logger
-                    controlled_vehicles_count = 0
-                    for vehicle_id, vehicle in enumerate(self.eval_env.unwrapped.road.vehicles):
-                        action = np.nan
-                        lane = vehicle.lane_index[2]
-                        acc = vehicle.action["acceleration"]
-                        reward = np.full(self.num_objectives, fill_value=np.nan)
-                        if vehicle.is_controlled:
-                            action = self.action[controlled_vehicles_count]
-                            reward = self.reward[controlled_vehicles_count][0]
-                            controlled_vehicles_count += 1
-                        vehicle_logger.add(repetition_nr, tuple_index, weight_tuple.tolist(), curr_num_iterations, 
-                                           vehicle_id, vehicle.is_controlled, action, vehicle.target_speed, vehicle.speed, 
-                                           acc, lane, vehicle.position[0], *reward.tolist())
+                    #populate vehicle logger with one block per step
+                    vehicles = self.eval_env.unwrapped.road.vehicles
+                    num_vehicles = len(vehicles)
+                    controlled_flags = np.fromiter((v.is_controlled for v in vehicles), dtype=bool, count=num_vehicles)
+                    #controlled vehicles appear in the same order in the road's vehicle list and in the actions/rewards
+                    num_present_controlled = np.count_nonzero(controlled_flags)
+                    actions = np.full(num_vehicles, fill_value=np.nan)
+                    actions[controlled_flags] = np.asarray(self.action)[:num_present_controlled]
+                    rewards = np.full((num_vehicles, self.num_objectives), fill_value=np.nan)
+                    rewards[controlled_flags] = np.asarray(self.reward)[:num_present_controlled, 0]
+                    vehicle_logger.add_block(num_vehicles, repetition_number=repetition_nr, weight_index=tuple_index, 
+                                             weight_tuple=weight_list, iteration=curr_num_iterations, vehicle_id=np.arange(num_vehicles), 
+                                             controlled_flag=controlled_flags.astype(np.int64), action=actions, 
+                                             target_speed=np.fromiter((v.target_speed for v in vehicles), dtype=np.float64, count=num_vehicles),
+                                             curr_speed=np.fromiter((v.speed for v in vehicles), dtype=np.float64, count=num_vehicles), 
+                                             acc=np.fromiter((v.action["acceleration"] for v in vehicles), dtype=np.float64, count=num_vehicles), 
+                                             lane=np.fromiter((v.lane_index[2] for v in vehicles), dtype=np.int64, count=num_vehicles), 
+                                             x_pos=np.fromiter((v.position[0] for v in vehicles), dtype=np.float64, count=num_vehicles),
+                                             **{f"curr_{x}": rewards[:,i] for i, x in enumerate(self.objective_names)})
 
                     curr_num_iterations += 1
 
                 #episode ended
                 normalised_reward = accumulated_reward / curr_num_iterations
                 for vehicle_id in range(self.num_controlled_vehicles):
-                    eval_logger.add(repetition_nr, tuple_index, weight_tuple.tolist(), curr_num_iterations, vehicle_id, *normalised_reward[vehicle_id].tolist(), *accumulated_reward[vehicle_id].tolist())
+                    eval_logger.add(repetition_nr, tuple_index, weight_list, curr_num_iterations, vehicle_id, *normalised_reward[vehicle_id].tolist(), *accumulated_reward[vehicle_id].tolist())
+        self.record_action_values = False
         
         #compute hypervolume if reference point is given
         if hv_reference_point is not None:
@@ -654,6 +906,7 @@ class MOMA_DQN:
     def load_network(self, model_path: str):
         self.policy_net = torch.load(model_path)
         self.target_net = torch.load(model_path)
+        self.__compile_networks()
 
     def load_network_weights(self, model_path: str):
         self.policy_net.load_state_dict(torch.load(model_path))
@@ -9,11 +9,10 @@ from src.utils import ReplayBuffer, random_objective_weights, DataLogger, Linear
 from torch.nn.modules.loss import _Loss
 from tqdm import trange
 from typing import List
-from pymoo.util.ref_dirs import get_reference_directions
 from DQN_Network import DQN_Network
 from mo_gymnasium import MONormalizeReward
 from copy import deepcopy
-from src.utils import calc_hypervolume
+from src.utils import calc_hypervolume, equally_spaced_weights
 import pandas as pd
 
 class MO_DQN:
@@ -119,10 +118,12 @@ class MO_DQN:
         hv_logger = DataLogger("hv_logger", feature_names)
 
 
-        self.obs, _ = self.env.reset()
-        self.obs = torch.tensor(self.obs[0].reshape(1,-1), device=self.device) #TODO: remove when going to multi-agent
+        host_obs, _ = self.env.reset()
+        host_obs = host_obs[0].reshape(1,-1) #TODO: remove when going to multi-agent
+        self.obs = torch.tensor(host_obs, device=self.device)
         self.epsilon = epsilon_start
-        self.optimiser = torch.optim.AdamW(self.policy_net.parameters(), lr=1e-3, amsgrad=True)
+        #on cuda, the fused implementation updates all parameters with a single kernel launch
+        self.optimiser = torch.optim.AdamW(self.policy_net.parameters(), lr=1e-3, amsgrad=True, fused=(self.device.type == "cuda"))
 
         self.loss_func = self.loss_criterion(reduction="mean")
         episode_nr = 0
@@ -140,16 +141,16 @@ class MO_DQN:
                 info,
             ) = self.env.step(self.action)
 
-            #cast return values to gpu tensor before storing them in replay buffer
-            self.next_obs = torch.tensor(self.next_obs[0].reshape(1,-1), device=self.device) #TODO: remove when going to multi-agent
+            #the replay buffer is kept in host memory, so the host values are pushed directly.
+            #Only the next observation is moved to the device for action selection
+            host_next_obs = self.next_obs[0].reshape(1,-1) #TODO: remove when going to multi-agent
+            self.next_obs = torch.tensor(host_next_obs, device=self.device)
             if self.num_objectives == 1:
                 self.reward = [self.reward]
-            self.reward = torch.tensor(self.reward, device=self.device)
-            self.action = torch.tensor([self.action], device=self.device)
-            self.terminated = torch.tensor([self.terminated], device=self.device)
             #push to replay buffer
-            self.buffer.push(self.obs, self.action, self.next_obs, self.reward, self.terminated)
+            self.buffer.push(host_obs, self.action, host_next_obs, self.reward, self.terminated)
             self.obs = self.next_obs #use next_obs as obs during the next iteration
+            host_obs = host_next_obs
             
             #update the weights every optimisation_frequency steps
             if (i % inv_optimisation_frequency) == 0:
@@ -165,8 +166,9 @@ class MO_DQN:
 
             if self.terminated or self.truncated:
                 episode_nr += 1
-                self.obs, _ = self.env.reset()
-                self.obs = torch.tensor(self.obs[0].reshape(1,-1), device=self.device) #TODO: remove when going to multi-agent
+                host_obs, _ = self.env.reset()
+                host_obs = host_obs[0].reshape(1,-1) #TODO: remove when going to multi-agent
+                self.obs = torch.tensor(host_obs, device=self.device)
                 self.objective_weights = random_objective_weights(self.num_objectives, self.rng, self.device)
         
         #prepare logger data
@@ -182,17 +184,16 @@ class MO_DQN:
         return df
 
     def __update_weights(self, current_iteration, current_optimisation_iteration, inv_target_update_frequency):
-        self.policy_net.train()
         #update normal network each time the function is called
         #update target network every k steps
 
         #fetch samples from replay buffer
-        batch_samples = self.buffer.sample(round(self.buffer.num_elements*self.batch_ratio))
-        observations = self.buffer.get_observations(batch_samples)
-        next_obs = self.buffer.get_next_obs(batch_samples)
-        actions = self.buffer.get_actions(batch_samples)
-        term_flags = self.buffer.get_termination_flag(batch_samples)
-        rewards  = self.buffer.get_rewards(batch_samples)
+        batch = self.buffer.sample_batch(round(self.buffer.num_elements*self.batch_ratio))
+        observations = batch["observations"]
+        next_obs = batch["next_obs"]
+        actions = batch["actions"]
+        term_flags = batch["termination_flags"]
+        rewards  = batch["rewards"]
         #go through each sample of the batch
         #fetch Q values of the current observation and action from all the objectives Q-networks
         #if (observations.shape[0] > 1):
@@ -201,7 +202,7 @@ class MO_DQN:
         state_action_values = state_action_values.gather(2, actions)
         state_action_values = state_action_values.reshape(observations.shape[0],self.num_objectives)
         
-        with torch.no_grad():
+        with torch.inference_mode():
             #code taken from https://github.com/eleurent/rl-agents/blob/master/rl_agents/agents/deep_q_network/pytorch.py
             if self.use_double_q_learning:
                 best_actions_policy_net = self.policy_net(next_obs).argmax(2).unsqueeze(2)
@@ -210,7 +211,8 @@ class MO_DQN:
             else:
                 next_state_values = self.target_net(next_obs).max(2).values
 
-        next_state_values[term_flags] = 0
+        #inference tensors can't be modified in place outside of inference mode, torch.where creates a normal tensor instead
+        next_state_values = torch.where(term_flags.unsqueeze(-1), 0.0, next_state_values)
 
         exp_state_action_values = next_state_values * self.gamma + rewards
         #compute loss between estimates and actual values
@@ -220,7 +222,7 @@ class MO_DQN:
         #backpropagate loss
         self.optimiser.zero_grad()
         loss.backward()
-        torch.nn.utils.clip_grad_value_(self.policy_net.parameters(), 100)
+        torch.nn.utils.clip_grad_value_(self.policy_net.parameters(), 100, foreach=(self.device.type == "cuda"))
         self.optimiser.step()
 
         #update the target networks
@@ -237,8 +239,7 @@ class MO_DQN:
 
         #select best action according to policy
         if not eps_greedy or r > self.epsilon:
-            with torch.no_grad():
-                self.policy_net.eval()
+            with torch.inference_mode():
                 q_values = self.policy_net(obs)
                 q_values = q_values.reshape(self.num_objectives, self.num_actions)
                 scalarised_values = self.scalarisation_method.scalarise_actions(q_values, self.objective_weights)
@@ -267,8 +268,8 @@ class MO_DQN:
         
         self.rng = np.random.default_rng(seed)
         #get equally spaced objective weights
-        objective_weights = get_reference_directions("energy", n_dim = self.num_objectives, n_points = num_points, seed=seed)
-        objective_weights = torch.from_numpy(objective_weights).to(self.device)
+        objective_weights = equally_spaced_weights(self.num_objectives, num_points, seed)
+        objective_weights = torch.from_numpy(objective_weights).to(self.device) #single transfer of all weight tuples
         
         #instantiate data loggers
         #for summary information
@@ -286,6 +287,7 @@ class MO_DQN:
         for tuple_index in trange(objective_weights.shape[0], desc="Weight tuple", mininterval=1):
             weight_tuple = objective_weights[tuple_index]
             self.objective_weights = weight_tuple
+            weight_list = weight_tuple.tolist()
             
             for repetition_nr in range(num_repetitions):
                 self.terminated = False
@@ -314,24 +316,27 @@ class MO_DQN:
                         self.reward = info["rewards"]
 
                     #populate vehicle logger
-                    for v_id, vehicle in enumerate(self.eval_env.unwrapped.road.vehicles):
-                        action = np.nan
-                        lane = vehicle.lane_index[2]
-                        acc = vehicle.action["acceleration"]
-                        reward = np.full(self.num_objectives, fill_value=np.nan)
-                        if vehicle.is_controlled:
-                            action = self.action
-                            reward = self.reward
-                        vehicle_logger.add(repetition_nr, tuple_index, weight_tuple.tolist(), curr_num_iterations, 
-                                           v_id, vehicle.is_controlled, action, vehicle.target_speed, vehicle.speed, 
-                                           acc, lane, *reward.tolist())
+                    vehicles = self.eval_env.unwrapped.road.vehicles
+                    num_vehicles = len(vehicles)
+                    controlled_flags = np.fromiter((v.is_controlled for v in vehicles), dtype=bool, count=num_vehicles)
+                    actions = np.where(controlled_flags, self.action, np.nan)
+                    rewards = np.full((num_vehicles, self.num_objectives), fill_value=np.nan)
+                    rewards[controlled_flags] = self.reward
+                    vehicle_logger.add_block(num_vehicles, repetition_number=repetition_nr, weight_index=tuple_index, 
+                                             weight_tuple=weight_list, iteration=curr_num_iterations, vehicle_id=np.arange(num_vehicles), 
+                                             controlled_flag=controlled_flags.astype(np.int64), action=actions, 
+                                             target_speed=np.fromiter((v.target_speed for v in vehicles), dtype=np.float64, count=num_vehicles),
+                                             curr_speed=np.fromiter((v.speed for v in vehicles), dtype=np.float64, count=num_vehicles), 
+                                             acc=np.fromiter((v.action["acceleration"] for v in vehicles), dtype=np.float64, count=num_vehicles), 
+                                             lane=np.fromiter((v.lane_index[2] for v in vehicles), dtype=np.int64, count=num_vehicles), 
+                                             **{f"curr_{x}": rewards[:,i] for i, x in enumerate(self.objective_names)})
                         
                     accumulated_reward = accumulated_reward + self.reward
                     curr_num_iterations += 1
 
                 #episode ended
                 normalised_reward = accumulated_reward / curr_num_iterations
-                eval_logger.add(repetition_nr, tuple_index, weight_tuple.tolist(), curr_num_iterations, *normalised_reward.tolist(), *accumulated_reward.tolist())
+                eval_logger.add(repetition_nr, tuple_index, weight_list, curr_num_iterations, *normalised_reward.tolist(), *accumulated_reward.tolist())
         
         #compute hypervolume if reference point is given
         if hv_reference_point is not None:
@@ -0,0 +1,51 @@
+from typing import Tuple
+import torch
+from highway_env import utils
+from utils import random_objective_weights
+
+class MOHighwayEnvMixin:
+    '''Helpers shared by the multi-objective highway environments.
+    Environments using it have to call _reset_reward_state on every reset, after the road and the vehicles were created.'''
+
+    def _reset_reward_state(self) -> None:
+        self.energy_consumption_function = self.config["energy_consumption_function"](self.vehicle.target_speeds, self.vehicle.KP_A)
+        self.num_side_lanes = {} #number of side lanes for each road segment, the road is recreated on every reset
+        self.reward_scales = None #computed on the first normalisation after a reset
+
+    def _get_reward_scales(self) -> Tuple[float, float]:
+        '''returns the inverse ranges of the reward normalisation, both rewards are mapped from [0, max] to [0, 1].
+        They are only computed when rewards are normalised, so that reward weights summing to zero don't fail otherwise'''
+        if self.reward_scales is None:
+            self.reward_scales = (
+                1.0 / (float(self.config["high_speed_reward"]) + float(self.config["right_lane_reward"])),
+                1.0 / (float(self.config["energy_consumption_reward"]) + float(self.config["right_lane_reward"])),
+            )
+        return self.reward_scales
+
+    def _normalize_rewards(self, rewards):
+        '''maps the speed and energy rewards linearly from [0, max] to [0, 1] using the scales cached since the last reset'''
+        speed_scale, energy_scale = self._get_reward_scales()
+        return rewards[0] * speed_scale, rewards[1] * energy_scale
+
+    def _get_num_side_lanes(self, lane_index) -> int:
+        '''returns the number of lanes of the road segment of lane_index. It only depends on the segment, so it is cached'''
+        segment = lane_index[0:2]
+        if segment not in self.num_side_lanes:
+            self.num_side_lanes[segment] = len(self.road.network.all_side_lanes(lane_index))
+        return self.num_side_lanes[segment]
+
+    def _get_other_vehicles_type(self):
+        '''returns the class of the uncontrolled vehicles. The class path is only resolved again if the config changes'''
+        path = self.config["other_vehicles_type"]
+        if getattr(self, "other_vehicles_path", None) != path:
+            self.other_vehicles_path = path
+            self.other_vehicles_cls = utils.class_from_path(path)
+        return self.other_vehicles_cls
+
+def draw_vehicle_objective_weights(config: dict, num_controlled_vehicles: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    '''returns random objective weights for the controlled vehicles (2-objectives), drawn for all of them at once,
+    and the weights of 0.0 for the uncontrolled vehicles. The weights of vehicles are only read, so all uncontrolled vehicles
+    share the same tensor. The weights of the controlled vehicles can be overriden during training by the MOMA-RL-algorithm'''
+    controlled_obj_weights = random_objective_weights(num_objectives=2, rng = config["rng"], device= config["device"], num_weights=num_controlled_vehicles)
+    zero_obj_weights = torch.zeros(2, device=config["device"], dtype=controlled_obj_weights.dtype)
+    return controlled_obj_weights, zero_obj_weights
@@ -1,4 +1,5 @@
-from typing import Dict, Text
+from typing import Dict, Text, Tuple
+import math
 import numpy as np
 from highway_env import utils
 from highway_env.envs import HighwayEnvFast
@@ -7,12 +8,20 @@ from highway_env.vehicle.controller import ControlledVehicle
 from highway_env.utils import near_split
 from energy_calculation import NaiveEnergyCalculation
 import torch
-from utils import random_objective_weights
+from env_utils import MOHighwayEnvMixin, draw_vehicle_objective_weights
 from highway_env.envs.common.action import action_factory, Action
 from highway_env.envs.common.observation import observation_factory
 from observations import AugmentedMultiAgentObservation
 
-class MOHighwayEnv(HighwayEnvFast):
+def _compute_rewards(forward_speed: float, lane: int, num_neighbours: int, efficiency: float, reward_params: Tuple) -> Tuple[float, float]:
+    '''computes the unnormalised speed and energy rewards from plain floats. reward_params contains the high speed, right lane 
+    and energy consumption reward weights followed by the lower and upper bound of the reward speed range'''
+    high_speed_reward, right_lane_reward, energy_consumption_reward, min_speed, max_speed = reward_params
+    scaled_speed = min(max((forward_speed - min_speed) / (max_speed - min_speed), 0.0), 1.0)
+    right_lane = right_lane_reward * lane / max(num_neighbours - 1, 1)
+    return high_speed_reward * scaled_speed + right_lane, energy_consumption_reward * efficiency + right_lane
+
+class MOHighwayEnv(MOHighwayEnvMixin, HighwayEnvFast):
     '''Extends the standard highway environment to work with multiple objectives. The code was taken straight
     from the HighwayEnv class of the highway_env module and adjusted at various points.'''
 
@@ -51,70 +60,71 @@ class MOHighwayEnv(HighwayEnvFast):
         })
         return config
 
-    def _reward(self, action: Action) -> float:
+    def _reset(self) -> None:
+        super()._reset()
+        self._reset_reward_state()
+        #the reward weights and the reward speed range as plain floats for the per step reward computation
+        self.reward_params = (
+            float(self.config["high_speed_reward"]),
+            float(self.config["right_lane_reward"]),
+            float(self.config["energy_consumption_reward"]),
+            float(self.config["reward_speed_range"][0]),
+            float(self.config["reward_speed_range"][1]),
+        )
+        self.step_reward = None #the reward of the current step, not computed yet after a reset
 
-        rewards = self._rewards(action)
-        scalarised_rewards = {
-            name: self.config.get(name, 0) * reward for name, reward in rewards.items()
-        }
-        speed_reward = scalarised_rewards["high_speed_reward"] + scalarised_rewards["right_lane_reward"]
-        energy_reward = scalarised_rewards["energy_consumption_reward"] + scalarised_rewards["right_lane_reward"]
+    def _reward(self, action: Action) -> float:
+        forward_speed, lane, num_neighbours, efficiency = self.__reward_inputs()
+        speed_reward, energy_reward = _compute_rewards(forward_speed, lane, num_neighbours, efficiency, self.reward_params)
 
         #default normalisation
         if self.config["normalize_reward"]:
-            speed_reward, energy_reward = self.__normalize_rewards([speed_reward, energy_reward])
+            speed_reward, energy_reward = self._normalize_rewards((speed_reward, energy_reward))
         else:
-            self.raw_rewards = scalarised_rewards #store raw rewards for info function
+            #store raw rewards for info function
+            self.raw_rewards = {
+                name: self.config.get(name, 0) * reward for name, reward in self.__rewards_dict(forward_speed, lane, num_neighbours, efficiency).items()
+            }
         
-        #rewards["collision_reward"] indicates whether there has been a crash
-        if rewards["collision_reward"] != 0:
+        #indicates whether there has been a crash
+        if self.vehicle.crashed:
            speed_reward = self.config["collision_reward"]
            energy_reward = self.config["collision_reward"]
-                   
-        return np.array([speed_reward, energy_reward])
+        
+        #kept for the info dict, which is created right after the reward within the same step
+        self.step_reward = np.array([speed_reward, energy_reward])
+        return self.step_reward
 
     def _rewards(self, action: Action) -> Dict[Text, float]:
-        #if its the first time this function is called: initialise energy consumption function
-        if not hasattr(self, 'energy_consumption_function'):
-            self.energy_consumption_function = self.config["energy_consumption_function"](self.vehicle.target_speeds, self.vehicle.KP_A)
-
-        neighbours = self.road.network.all_side_lanes(self.vehicle.lane_index)
+        return self.__rewards_dict(*self.__reward_inputs())
+    
+    def __reward_inputs(self) -> Tuple[float, int, int, float]:
+        '''returns the forward speed, the lane index, the number of neighbouring lanes and the energy efficiency of the vehicle'''
+        num_neighbours = self._get_num_side_lanes(self.vehicle.lane_index)
         lane = self.vehicle.target_lane_index[2] if isinstance(self.vehicle, ControlledVehicle) \
             else self.vehicle.lane_index[2]
         # Use forward speed rather than speed, see https://github.com/eleurent/highway-env/issues/268
-        forward_speed = self.vehicle.speed * np.cos(self.vehicle.heading)
+        forward_speed = self.vehicle.speed * math.cos(self.vehicle.heading)
+        efficiency = self.energy_consumption_function.compute_efficiency(self.vehicle, True)
+        return forward_speed, lane, num_neighbours, efficiency
+    
+    def __rewards_dict(self, forward_speed, lane, num_neighbours, efficiency) -> Dict[Text, float]:
         scaled_speed = utils.lmap(forward_speed, self.config["reward_speed_range"], [0, 1])
         return {
             "collision_reward": float(self.vehicle.crashed),
-            "right_lane_reward": lane / max(len(neighbours) - 1, 1),
+            "right_lane_reward": lane / max(num_neighbours - 1, 1),
             "high_speed_reward": np.clip(scaled_speed, 0, 1),
-            "energy_consumption_reward": self.energy_consumption_function.compute_efficiency(self.vehicle, True)
+            "energy_consumption_reward": efficiency
         }
     
-    def __normalize_rewards(self, rewards):
-        speed_reward = rewards[0]
-        energy_reward = rewards[1]
-
-        speed_reward = utils.lmap(speed_reward,
-                                [0,
-                                    self.config["high_speed_reward"] + self.config["right_lane_reward"]],
-                                [0, 1])
-        
-        energy_reward = utils.lmap(energy_reward,
-                                [0,
-                                    self.config["energy_consumption_reward"] + self.config["right_lane_reward"]],
-                                [0, 1])
-        
-        return speed_reward, energy_reward
-
     def _create_vehicles(self) -> None:
         """Create some new random vehicles of a given type, and add them on the road."""
-        other_vehicles_type = utils.class_from_path(self.config["other_vehicles_type"])
+        other_vehicles_type = self._get_other_vehicles_type()
         other_per_controlled = near_split(self.config["vehicles_count"], num_bins=self.config["controlled_vehicles"])
 
         self.controlled_vehicles = []
-        
-        for others in other_per_controlled:
+        controlled_obj_weights, zero_obj_weights = draw_vehicle_objective_weights(self.config, len(other_per_controlled))
+        for vehicle_nr, others in enumerate(other_per_controlled):
             #controlled vehicle
             vehicle = Vehicle.create_random(
                 self.road,
@@ -124,15 +134,9 @@ class MOHighwayEnv(HighwayEnvFast):
             )
             vehicle = self.action_type.vehicle_class(self.road, vehicle.position, vehicle.heading, vehicle.speed)
             vehicle.is_controlled = 1
-            #set random objective weights for controlled vehicles (2-objectives)
-            #can be overriden during training by the MOMA-RL-algorithm
-            vehicle.objective_weights = random_objective_weights(num_objectives=2, rng = self.config["rng"], device= self.config["device"])
+            vehicle.objective_weights = controlled_obj_weights[vehicle_nr]
             
             #add controlled vehicle to list
-            max_speed = vehicle.target_speeds[-1]
-            min_speed = vehicle.target_speeds[0]
-            vehicle.MAX_SPEED = max_speed
-            vehicle.MIN_SPEED = min_speed
             self.controlled_vehicles.append(vehicle)
             self.road.vehicles.append(vehicle)
 
@@ -143,10 +147,15 @@ class MOHighwayEnv(HighwayEnvFast):
                 vehicle.is_controlled = 0
 
                 #set weights of 0.0 for each objective for uncontrolled vehicles (2-objectives)
-                vehicle.MAX_SPEED = max_speed
-                vehicle.MIN_SPEED = min_speed
-                vehicle.objective_weights = torch.tensor([0.0,0.0], device=self.config["device"])
+                vehicle.objective_weights = zero_obj_weights
                 self.road.vehicles.append(vehicle)
+
+        #all controlled vehicles share the target speeds of the action type, so the speed limits of all vehicles are set in one pass
+        target_speeds = self.controlled_vehicles[0].target_speeds
+        max_speed, min_speed = target_speeds[-1], target_speeds[0]
+        for vehicle in self.road.vehicles:
+            vehicle.MAX_SPEED = max_speed
+            vehicle.MIN_SPEED = min_speed
     
     def _info(self, obs, action = None) -> dict:
         """
@@ -156,19 +165,15 @@ class MOHighwayEnv(HighwayEnvFast):
         :param action: current action
         :return: info dict
         """
-        info = {
+        rewards = self.step_reward if self.step_reward is not None else self._reward(action)
+        return {
             "speed": self.vehicle.speed,
             "crashed": self.vehicle.crashed,
             "action": action,
+            #if not normalised, report normalised rewards in info dict. Otherwise the info dict gets its own copy, 
+            #as reward wrappers may modify the returned reward in place
+            "rewards": self._normalize_rewards(rewards) if not self.config["normalize_reward"] else rewards.copy(),
         }
-        try:
-            info["rewards"] = self._reward(action)
-            #if not normalised, report normalised rewards in info dict
-            if not self.config["normalize_reward"]:
-                info["rewards"] = self.__normalize_rewards(info["rewards"])
-        except NotImplementedError:
-            pass
-        return info
 
     def define_spaces(self) -> None:
         """
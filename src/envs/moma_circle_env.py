@@ -13,7 +13,7 @@ from observations import AugmentedMultiAgentObservation
 from highway_env.envs.common.action import action_factory
 from highway_env.utils import near_split
 import torch
-from utils import random_objective_weights
+from env_utils import draw_vehicle_objective_weights
 from highway_env.vehicle.behavior import IDMVehicle, LinearVehicle
 
 Observation = TypeVar("Observation")
@@ -111,7 +111,7 @@ class MOMACircleEnv(CircleEnv):
             return reward_dict_lists
 
     def _compute_vehicle_reward(self, reward_dict):
-        '''Computes the reward tuple for a single vehicle based on the information in the reward dictionary.'''
+        '''Computes the (speed, energy) reward tuple for a single vehicle based on the information in the reward dictionary.'''
         rewards = reward_dict
         scalarised_rewards = {
             name: self.config.get(name, 0) * reward for name, reward in rewards.items()
@@ -127,7 +127,8 @@ class MOMACircleEnv(CircleEnv):
            speed_reward = self.config["collision_reward"]
            energy_reward = self.config["collision_reward"]
 
-        return np.array([speed_reward, energy_reward])
+        #plain tuple, it is written into the reward array of all vehicles by the caller
+        return speed_reward, energy_reward
 
     def __normalize_rewards(self, rewards):
         speed_reward = rewards[0]
@@ -189,7 +190,8 @@ class MOMACircleEnv(CircleEnv):
 
         self.controlled_vehicles = []
         lane_counter = np.zeros(len(self.road.network.graph.keys()), dtype=int)
-        for others in other_per_controlled:
+        controlled_obj_weights, zero_obj_weights = draw_vehicle_objective_weights(self.config, len(other_per_controlled))
+        for vehicle_nr, others in enumerate(other_per_controlled):
 
             #controlled vehicle
             vehicle = MOMACircleEnv.create_at(
@@ -203,9 +205,7 @@ class MOMACircleEnv(CircleEnv):
 
             vehicle = self.action_type.vehicle_class(self.road, vehicle.position, vehicle.heading, vehicle.speed)
             vehicle.is_controlled = 1
-            #set random objective weights for controlled vehicles (2-objectives)
-            #can be overriden during training by the MOMA-RL-algorithm
-            vehicle.objective_weights = random_objective_weights(num_objectives=2, rng = self.config["rng"], device= self.config["device"])
+            vehicle.objective_weights = controlled_obj_weights[vehicle_nr]
             
             #add controlled vehicle to list
             vehicle.MAX_SPEED = self.config["max_speed"]
@@ -233,7 +233,7 @@ class MOMACircleEnv(CircleEnv):
                 #set weights of 0.0 for each objective for uncontrolled vehicles (2-objectives)
                 vehicle.MAX_SPEED = self.config["max_speed"]
                 vehicle.MIN_SPEED = self.config["min_speed"]
-                vehicle.objective_weights = torch.tensor([0.0,0.0], device=self.config["device"])
+                vehicle.objective_weights = zero_obj_weights
                 self.road.vehicles.append(vehicle)
 
     def create_at(cls, road: Road,
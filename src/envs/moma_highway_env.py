@@ -12,11 +12,11 @@ from highway_env.envs.common.action import action_factory
 from observations import AugmentedMultiAgentObservation
 from energy_calculation import NaiveEnergyCalculation
 import torch
-from utils import random_objective_weights
+from env_utils import MOHighwayEnvMixin, draw_vehicle_objective_weights
 
 Observation = TypeVar("Observation")
 
-class MOMAHighwayEnv(HighwayEnvFast):
+class MOMAHighwayEnv(MOHighwayEnvMixin, HighwayEnvFast):
     '''Extends the standard highway environment to work with multiple objectives and agents. The code was taken straight
     from the HighwayEnv class of the highway_env module and adjusted at various points.'''
 
@@ -61,96 +61,101 @@ class MOMAHighwayEnv(HighwayEnvFast):
         return config
 
     def _reward(self, action: Action) -> float:
-        '''Fetches the reward dictionaries for all ego vehicles and their closest neighbouring cars and uses that 
+        '''Computes the rewards of all ego vehicles and their closest neighbouring cars and uses that 
            to construct a reward array, containing the two-dimensional rewards for each vehicle. 
-           The first vehicle in the second dimension corresponds to an ego-vehicle'''
+           The first vehicle in the second dimension corresponds to an ego-vehicle.
+           The per vehicle inputs are gathered in one pass, the rewards of all vehicles are then computed with array operations'''
         
         num_close_vehicles = self.observation_type.agents_observation_types[0].vehicles_count
-        reward_dict_lists = self._rewards(action)
+        vehicle_lists = self.observation_type.curr_observation_vehicle_lists
         #rows with np.nan indicate missing close vehicle
-        reward_array = np.full(shape=(len(reward_dict_lists),num_close_vehicles,2), fill_value=np.nan) #2 because we have two objectives
+        reward_array = np.full(shape=(len(vehicle_lists),num_close_vehicles,2), fill_value=np.nan) #2 because we have two objectives
         
-        for i, dict_list in enumerate(reward_dict_lists):
-            for j, reward_dict in enumerate(dict_list):
-                reward_array[i,j,:] = self._compute_vehicle_reward(reward_dict)
-        return reward_array
-    
-    def _compute_vehicle_reward(self, reward_dict):
-        '''Computes the reward tuple for a single vehicle based on the information in the reward dictionary.'''
-        rewards = reward_dict
-        scalarised_rewards = {
-            name: self.config.get(name, 0) * reward for name, reward in rewards.items()
-        }
-        speed_reward = scalarised_rewards["high_speed_reward"] + scalarised_rewards["right_lane_reward"]
-        energy_reward = scalarised_rewards["energy_consumption_reward"] + scalarised_rewards["right_lane_reward"]
-        
-        if self.config["normalize_reward"]:
-            speed_reward, energy_reward = self.__normalize_rewards([speed_reward, energy_reward])
+        rows, cols, rewards = self.__reward_components(vehicle_lists)
+        if rows.size == 0:
+            return reward_array
 
-        #rewards["collision_reward"] indicates whether there has been a crash
-        if rewards["collision_reward"] != 0:
-           speed_reward = self.config["collision_reward"]
-           energy_reward = self.config["collision_reward"]
+        right_lane = self.config["right_lane_reward"] * rewards["right_lane_reward"]
+        speed_reward = self.config["high_speed_reward"] * rewards["high_speed_reward"] + right_lane
+        energy_reward = self.config["energy_consumption_reward"] * rewards["energy_consumption_reward"] + right_lane
 
-        return np.array([speed_reward, energy_reward])
-    
-    def __normalize_rewards(self, rewards):
-        speed_reward = rewards[0]
-        energy_reward = rewards[1]
-
-        speed_reward = utils.lmap(speed_reward,
-                                [0,
-                                    self.config["high_speed_reward"] + self.config["right_lane_reward"]],
-                                [0, 1])
-        
-        energy_reward = utils.lmap(energy_reward,
-                                [0,
-                                    self.config["energy_consumption_reward"] + self.config["right_lane_reward"]],
-                                [0, 1])
-        
-        return speed_reward, energy_reward
+        if self.config["normalize_reward"]:
+            speed_reward, energy_reward = self._normalize_rewards((speed_reward, energy_reward))
+
+        reward_array[rows, cols, 0] = speed_reward
+        reward_array[rows, cols, 1] = energy_reward
+        #vehicles involved in a crash receive the collision reward for both objectives
+        crashed = rewards["collision_reward"] != 0
+        reward_array[rows[crashed], cols[crashed]] = self.config["collision_reward"]
+        return reward_array
 
     def _rewards(self, action: Action) -> Dict[Text, float]:
         '''constructs the reward dictionaries for each vehicle using the variable curr_observation_vehicle_lists in
-           AugmentedMultiAgentObservation.'''
-        
-        #fetch vehicles of the current observation from observation type
+           AugmentedMultiAgentObservation. They contain the same components as the reward array of _reward'''
         vehicle_lists = self.observation_type.curr_observation_vehicle_lists
-        #if its the first time this function is called: initialise energy consumption function
-        if not hasattr(self, 'energy_consumption_function'):
-            self.energy_consumption_function = self.config["energy_consumption_function"](self.vehicle.target_speeds, self.vehicle.KP_A)
-
-        reward_dict_lists = [] #list containing a list of reward dicts for each vehicle
-        for v_list in vehicle_lists:
-            dict_list = [] #list containing the reward dicts for an ego-vehicle and it's close vehicles
-            for vehicle in v_list:
-
-                neighbours = self.road.network.all_side_lanes(vehicle.lane_index)
-                lane = vehicle.target_lane_index[2] if isinstance(vehicle, ControlledVehicle) \
-                    else vehicle.lane_index[2]
-                # Use forward speed rather than speed, see https://github.com/eleurent/highway-env/issues/268
-                forward_speed = vehicle.speed * np.cos(vehicle.heading)
-                scaled_speed = utils.lmap(forward_speed, self.config["reward_speed_range"], [0, 1])
-
-                dict = {
-                    "collision_reward": float(vehicle.crashed),
-                    "right_lane_reward": lane / max(len(neighbours) - 1, 1),
-                    "high_speed_reward": np.clip(scaled_speed, 0, 1),
-                    "energy_consumption_reward": self.energy_consumption_function.compute_efficiency(vehicle, normalise=self.config["normalize_reward"])
-                }
-                dict_list.append(dict)
-            reward_dict_lists.append(dict_list)
-        
+        rows, _, rewards = self.__reward_components(vehicle_lists)
+
+        reward_dict_lists = [[] for _ in vehicle_lists] #list containing a list of reward dicts for each vehicle
+        for k, row in enumerate(rows):
+            reward_dict_lists[row].append({name: float(values[k]) for name, values in rewards.items()})
         return reward_dict_lists
 
+    def __reward_components(self, vehicle_lists):
+        '''returns the position in the reward array and the unweighted reward components of every vehicle in vehicle_lists.
+        The components are arrays, keyed by the name of their reward weight in the config'''
+        rows, cols, forward_speed, lane, num_neighbours, efficiency, crashed = self.__reward_inputs(vehicle_lists)
+        min_speed, max_speed = self.config["reward_speed_range"]
+        return rows, cols, {
+            "collision_reward": crashed.astype(np.float64),
+            "right_lane_reward": lane / np.maximum(num_neighbours - 1, 1),
+            "high_speed_reward": np.clip((forward_speed - min_speed) / (max_speed - min_speed), 0, 1),
+            "energy_consumption_reward": efficiency,
+        }
+    
+    def __reward_inputs(self, vehicle_lists):
+        '''returns the position in the reward array, the forward speed, the lane index, the number of neighbouring lanes, 
+        the energy efficiency and the crash flag of every vehicle in vehicle_lists as numpy arrays'''
+        num_vehicles = sum(len(v_list) for v_list in vehicle_lists)
+        rows = np.empty(num_vehicles, dtype=np.int64)
+        cols = np.empty(num_vehicles, dtype=np.int64)
+        speed = np.empty(num_vehicles)
+        heading = np.empty(num_vehicles)
+        lane = np.empty(num_vehicles)
+        num_neighbours = np.empty(num_vehicles)
+        efficiency = np.empty(num_vehicles)
+        crashed = np.empty(num_vehicles, dtype=bool)
+
+        k = 0
+        for i, v_list in enumerate(vehicle_lists):
+            for j, vehicle in enumerate(v_list):
+                rows[k] = i
+                cols[k] = j
+                speed[k] = vehicle.speed
+                heading[k] = vehicle.heading
+                lane[k] = vehicle.target_lane_index[2] if isinstance(vehicle, ControlledVehicle) else vehicle.lane_index[2]
+                num_neighbours[k] = self._get_num_side_lanes(vehicle.lane_index)
+                efficiency[k] = self.energy_consumption_function.compute_efficiency(vehicle, normalise=self.config["normalize_reward"])
+                crashed[k] = vehicle.crashed
+                k += 1
+        
+        # Use forward speed rather than speed, see https://github.com/eleurent/highway-env/issues/268
+        forward_speed = speed * np.cos(heading)
+        return rows, cols, forward_speed, lane, num_neighbours, efficiency, crashed
+
+    def _reset(self) -> None:
+        super()._reset()
+        self._reset_reward_state()
+
     def _create_vehicles(self) -> None:
         """Create some new random vehicles of a given type, and add them on the road."""
-        other_vehicles_type = utils.class_from_path(self.config["other_vehicles_type"])
+        other_vehicles_type = self._get_other_vehicles_type()
         other_per_controlled = near_split(self.config["vehicles_count"], num_bins=self.config["controlled_vehicles"])
 
         self.controlled_vehicles = []
+        controlled_obj_weights, zero_obj_weights = draw_vehicle_objective_weights(self.config, len(other_per_controlled))
+        uncontrolled_vehicles = []
         
-        for others in other_per_controlled:
+        for vehicle_nr, others in enumerate(other_per_controlled):
             #controlled vehicle
             vehicle = Vehicle.create_random(
                 self.road,
@@ -160,15 +165,9 @@ class MOMAHighwayEnv(HighwayEnvFast):
             )
             vehicle = self.action_type.vehicle_class(self.road, vehicle.position, vehicle.heading, vehicle.speed)
             vehicle.is_controlled = 1
-            #set random objective weights for controlled vehicles (2-objectives)
-            #can be overriden during training by the MOMA-RL-algorithm
-            vehicle.objective_weights = random_objective_weights(num_objectives=2, rng = self.config["rng"], device= self.config["device"])
+            vehicle.objective_weights = controlled_obj_weights[vehicle_nr]
             
             #add controlled vehicle to list
-            max_speed = vehicle.target_speeds[-1]
-            min_speed = vehicle.target_speeds[0]
-            vehicle.MAX_SPEED = max_speed
-            vehicle.MIN_SPEED = min_speed
             self.controlled_vehicles.append(vehicle)
             self.road.vehicles.append(vehicle)
 
@@ -179,18 +178,32 @@ class MOMAHighwayEnv(HighwayEnvFast):
                 vehicle.is_controlled = 0
 
                 #set weights of 0.0 for each objective for uncontrolled vehicles (2-objectives)
-                vehicle.MAX_SPEED = max_speed
-                vehicle.MIN_SPEED = min_speed
-                if self.config["set_uncontrolled_obj_weights"]:
-                    self.set_uncontrolled_vehicle_obj_weights(vehicle, min_speed, max_speed)
-                else:
-                    vehicle.objective_weights = torch.tensor([0.0,0.0], device=self.config["device"])
+                vehicle.objective_weights = zero_obj_weights
+                uncontrolled_vehicles.append(vehicle)
                 self.road.vehicles.append(vehicle)
 
-    def set_uncontrolled_vehicle_obj_weights(self, vehicle, min_speed, max_speed):
-        target_speed = vehicle.target_speed
-        speed_obj_weight = (target_speed - min_speed) / (max_speed - min_speed)
-        vehicle.objective_weights = torch.tensor([speed_obj_weight, 1 - speed_obj_weight], device=self.config["device"])
+        #all controlled vehicles share the target speeds of the action type, so the speed limits of all vehicles are set in one pass
+        target_speeds = self.controlled_vehicles[0].target_speeds
+        max_speed, min_speed = target_speeds[-1], target_speeds[0]
+        for vehicle in self.road.vehicles:
+            vehicle.MAX_SPEED = max_speed
+            vehicle.MIN_SPEED = min_speed
+
+        if self.config["set_uncontrolled_obj_weights"]:
+            self.set_uncontrolled_vehicle_obj_weights(uncontrolled_vehicles)
+
+    def set_uncontrolled_vehicle_obj_weights(self, vehicles):
+        """Estimate the objective weights of uncontrolled vehicles based on their target speeds.
+        The weights of all vehicles are moved to the device with a single transfer."""
+        if len(vehicles) == 0:
+            return
+        target_speeds = np.array([vehicle.target_speed for vehicle in vehicles])
+        min_speeds = np.array([vehicle.MIN_SPEED for vehicle in vehicles])
+        max_speeds = np.array([vehicle.MAX_SPEED for vehicle in vehicles])
+        speed_obj_weights = (target_speeds - min_speeds) / (max_speeds - min_speeds)
+        obj_weights = torch.tensor(np.stack([speed_obj_weights, 1 - speed_obj_weights], axis=1), device=self.config["device"])
+        for vehicle, weights in zip(vehicles, obj_weights):
+            vehicle.objective_weights = weights
 
     def _info(self, obs: Observation, action: Optional[Action] = None) -> dict:
         """
@@ -0,0 +1,151 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import torch
+import mo_gymnasium as mo_gym
+from highway_env import utils as highway_utils
+from highway_env.vehicle.controller import ControlledVehicle
+from pymoo.indicators.hv import HV
+from src.MOMA_DQN import MOMA_DQN
+from src.utils import ReplayBuffer, DataLogger, calc_hypervolume
+
+#deterministic comparisons of the optimised code paths with the implementations they replaced
+
+def reference_reward_summary(rewards, obj_weights, crashed, num_objectives):
+    '''loop over the controlled vehicles, as done by compute_reward_summary before it was vectorised'''
+    reward_summary = []
+    for i in range(rewards.shape[0]):
+        r = torch.from_numpy(rewards[i])
+        weights = torch.stack(obj_weights[i], dim=0)
+        weights[torch.all(weights == 0, dim=1)] = 1/num_objectives
+        if r.shape[0] > weights.shape[0]:
+            assert torch.isnan(r[weights.shape[0]:]).all()
+            r = r[:weights.shape[0]]
+        if crashed[i]:
+            r[:] = r[0][0].clone()
+            weights[:] = 1/num_objectives
+        weighted_reward = r * weights
+        ego_reward = r[0,:]
+        num_close_vehicles = 0
+        if weighted_reward.shape[0] > 1:
+            weighted_social_rewards = weighted_reward[1:,:]
+            num_close_vehicles = weighted_social_rewards.shape[0]
+            mean_weighted_social_reward = torch.sum(weighted_social_rewards,dim=0) / (num_close_vehicles)
+        else:
+            mean_weighted_social_reward = torch.tensor([0,0])
+        reward_summary.append(torch.hstack([ego_reward, mean_weighted_social_reward, torch.tensor([num_close_vehicles])]))
+    return torch.stack(reward_summary)
+
+def test_compute_reward_summary():
+    rng = np.random.default_rng(0)
+    num_close_vehicles = [4, 2, 1, 3]
+    rewards = np.full((len(num_close_vehicles), 4, 2), fill_value=np.nan)
+    obj_weights = []
+    for i, n in enumerate(num_close_vehicles):
+        rewards[i,:n] = rng.random((n, 2))
+        weights = [torch.from_numpy(w) for w in rng.dirichlet(np.ones(2), size=n)]
+        weights[-1] = torch.zeros(2, dtype=torch.float64) #uncontrolled vehicle
+        obj_weights.append(weights)
+    crashed = [False, True, False, False]
+
+    agent = MOMA_DQN.__new__(MOMA_DQN)
+    agent.device = torch.device("cpu")
+    agent.copy_stream = None
+    agent.staging_buffers = {}
+    agent.num_objectives = 2
+    agent.crashed = crashed
+
+    summary = agent.compute_reward_summary(rewards, obj_weights)
+    reference = reference_reward_summary(rewards.copy(), [[w.clone() for w in weights] for weights in obj_weights], crashed, 2)
+    torch.testing.assert_close(summary, reference)
+
+def test_calc_hypervolume_2d():
+    rng = np.random.default_rng(1)
+    reference_point = np.array([0.0, 0.0])
+    #some of the points don't dominate the reference point
+    reward_vector = rng.random((20, 2)) * 2 - 0.2
+    expected = HV(ref_point=reference_point)(reward_vector * (-1))
+    np.testing.assert_allclose(calc_hypervolume(reference_point, reward_vector), expected)
+    np.testing.assert_allclose(calc_hypervolume(reference_point, -np.ones((3, 2))), 0.0)
+
+def reference_sample(buffer: ReplayBuffer, sample_size, rng: np.random.Generator):
+    '''samples with rng.choice over normalised probabilities, as done by ReplayBuffer.sample before the inverse cdf sampling'''
+    imp_sampling_ids = buffer.importance_sampling_ids[:buffer.num_elements].astype(np.float64)
+    sample_probs = imp_sampling_ids - np.min(imp_sampling_ids) + 1
+    if buffer.prioritise_crashes:
+        crashed_flag = buffer.termination_flags[:buffer.num_elements]
+        sample_probs[crashed_flag] = sample_probs[crashed_flag] * 2
+    sample_probs = sample_probs / np.cumsum(sample_probs)[-1]
+    return rng.choice(buffer.num_elements, p=sample_probs, size=max(1,round(sample_size)), replace=True, shuffle=True)
+
+def test_replay_buffer_sample():
+    #the probabilities are integers with a power of two as total, so both ways of sampling round exactly the same
+    importance_sampling_ids = np.array([1, 1, 3, 1])
+    terminated = np.array([True, True, False, False])
+    buffer = ReplayBuffer(8, observation_space_shape=3, num_objectives=2, device=torch.device("cpu"),
+                          rng=np.random.default_rng(2), importance_sampling=True, prioritise_crashes=True)
+    buffer.push(np.zeros((4, 3)), np.arange(4), np.zeros((4, 3)), np.zeros((4, 2)), terminated, importance_sampling_ids, num_samples=4)
+
+    samples = buffer.sample(1000)
+    expected = reference_sample(buffer, 1000, np.random.default_rng(2))
+    np.testing.assert_array_equal(samples, expected)
+
+def test_data_logger_dtypes():
+    field_names = ["episode", "vehicle_id", "reward", "weight_tuple", "name", "crashed"]
+    entries = [
+        [0, 0, 1, [0.5, 0.5], "a", False],
+        [0, None, 0.5, [0.2, 0.8], "b", True],
+        [1, 2, None, [0.2, 0.8], 3, False],
+    ]
+    logger = DataLogger("logger", field_names, capacity=2)
+    for entry in entries:
+        logger.add(*entry)
+
+    entry_type = namedtuple("logger", field_names)
+    expected = pd.DataFrame([entry_type(*entry) for entry in entries])
+    pd.testing.assert_frame_equal(logger.to_dataframe(), expected)
+
+def reference_reward(env):
+    '''reward dicts and reward array of the multi agent highway environment, computed vehicle by vehicle as before the vectorisation'''
+    config = env.config
+    vehicle_lists = env.observation_type.curr_observation_vehicle_lists
+    reward_array = np.full(shape=(len(vehicle_lists), env.observation_type.agents_observation_types[0].vehicles_count, 2), fill_value=np.nan)
+    reward_dict_lists = [[] for _ in vehicle_lists]
+    for i, v_list in enumerate(vehicle_lists):
+        for j, vehicle in enumerate(v_list):
+            neighbours = env.road.network.all_side_lanes(vehicle.lane_index)
+            lane = vehicle.target_lane_index[2] if isinstance(vehicle, ControlledVehicle) else vehicle.lane_index[2]
+            forward_speed = vehicle.speed * np.cos(vehicle.heading)
+            scaled_speed = highway_utils.lmap(forward_speed, config["reward_speed_range"], [0, 1])
+            rewards = {
+                "collision_reward": float(vehicle.crashed),
+                "right_lane_reward": lane / max(len(neighbours) - 1, 1),
+                "high_speed_reward": np.clip(scaled_speed, 0, 1),
+                "energy_consumption_reward": env.energy_consumption_function.compute_efficiency(vehicle, normalise=config["normalize_reward"])
+            }
+            reward_dict_lists[i].append({name: float(reward) for name, reward in rewards.items()})
+            scalarised_rewards = {name: config.get(name, 0) * reward for name, reward in rewards.items()}
+            speed_reward = scalarised_rewards["high_speed_reward"] + scalarised_rewards["right_lane_reward"]
+            energy_reward = scalarised_rewards["energy_consumption_reward"] + scalarised_rewards["right_lane_reward"]
+            if config["normalize_reward"]:
+                speed_reward = highway_utils.lmap(speed_reward, [0, config["high_speed_reward"] + config["right_lane_reward"]], [0, 1])
+                energy_reward = highway_utils.lmap(energy_reward, [0, config["energy_consumption_reward"] + config["right_lane_reward"]], [0, 1])
+            if rewards["collision_reward"] != 0:
+                speed_reward = energy_reward = config["collision_reward"]
+            reward_array[i,j] = [speed_reward, energy_reward]
+    return reward_dict_lists, reward_array
+
+def test_moma_highway_reward():
+    for normalize_reward in [True, False]:
+        env = mo_gym.make('moma-highway-env-v0', config={"vehicles_count": 6, "controlled_vehicles": 3, "normalize_reward": normalize_reward})
+        env.action_space.seed(3)
+        env.reset(seed=3)
+        for _ in range(5):
+            env.step(env.action_space.sample())
+            reward_dict_lists, reward_array = reference_reward(env.unwrapped)
+            assert env.unwrapped._rewards(None) == reward_dict_lists
+            np.testing.assert_allclose(env.unwrapped._reward(None), reward_array)
+        env.close()
@@ -1,15 +1,23 @@
 import torch
 import numpy as np
-from collections import namedtuple
 from pymoo.indicators.hv import HV
+from pymoo.util.ref_dirs import get_reference_directions
 import pandas as pd
-from typing import List, TypeVar
+from typing import List, TypeVar, Dict, Tuple
 import gymnasium as gym
 from gymnasium.wrappers.normalize import RunningMeanStd
 
 ObsType = TypeVar("ObsType")
 ActType = TypeVar("ActType")
 
+def _chebyshev_distance(action_q_estimates: torch.Tensor, objective_weights: torch.Tensor, z_final: torch.Tensor) -> torch.Tensor:
+    '''weighted maximum distance between the q estimates of each action (last dimension: objectives) and z_final.
+    Plain python, so that it can be traced by torch.compile as part of a larger function'''
+    return torch.amax(torch.abs(action_q_estimates - z_final) * objective_weights, dim=-1)
+
+#scripted version for eager calls, so that the element-wise operations and the reduction can be fused into a single kernel
+_chebyshev_scalarisation = torch.jit.script(_chebyshev_distance)
+
 class ChebyshevScalarisation:
     """ This class computes the chebyshev scalarisation for a vectorial Q-value and corresponding utopian point z*
         as described in Scalarized Multi-Objective Reinforcement Learning: Novel Design Techniques
@@ -20,31 +28,74 @@ class ChebyshevScalarisation:
     
     def __init__(self, initial_utopian: torch.Tensor, threshold_value: float, device = torch.device("cuda" if torch.cuda.is_available() else "cpu")) -> None:
         self.device = device
-        self.z_star = initial_utopian.to(device) #initialise utopian point z*. It is a vector with the same dimensions as the vectorial Q-values
+        #initialise utopian point z*. It is a vector with the same dimensions as the vectorial Q-values.
+        #z* is updated in place, so it is stored as a float copy that doesn't alias the caller's tensor
+        self.z_star = initial_utopian.to(device=device, dtype=torch.float32).clone()
         self.threshold = threshold_value
+        self.z_final = torch.empty_like(self.z_star) #z* shifted by the threshold, updated in place
 
     def scalarise_actions(self, action_q_estimates: torch.Tensor, objective_weights: torch.Tensor) -> torch.Tensor:
         action_q_estimates = torch.swapaxes(action_q_estimates,0,1) #swap axes so that rows represent q estimates of one action for all objectives
         #action_q_estimates = action_q_estimates.flatten(start_dim=0, end_dim=1)
         self.update_utopian(action_q_estimates)
-        z_final = (self.z_star + self.threshold)#.reshape(-1,1)
-        diffs = action_q_estimates - z_final
-        abs_diffs = torch.abs(diffs)
-        weighted_diffs = objective_weights * abs_diffs#.reshape(-1,1) * abs_diffs
-        sq_values = torch.max(weighted_diffs, dim=1)[0]
-        return sq_values
+        return _chebyshev_scalarisation(action_q_estimates, objective_weights, self.z_final)
+
+    def scalarise_actions_batched(self, action_q_estimates: torch.Tensor, objective_weights: torch.Tensor, update_mask: torch.Tensor = None) -> torch.Tensor:
+        '''scalarises the q estimates of several agents at once. action_q_estimates has the shape (num_agents, num_objectives, num_actions),
+        objective_weights is either shared by all agents or has the shape (num_agents, num_objectives).
+        The returned tensor has the shape (num_agents, num_actions).
+        As with the scalarisation of single agents, z* is only updated with the q estimates of agents that act greedily. 
+        These are selected by the boolean update_mask of shape (num_agents,), all agents update z* if it is None.
+        Unlike the scalarisation of one agent after another, the q estimates of all these agents are folded into z* before any of them is scalarised'''
+        action_q_estimates = torch.swapaxes(action_q_estimates,1,2) #rows represent q estimates of one action for all objectives
+        update_vector = action_q_estimates
+        if update_mask is not None:
+            #masked agents are replaced by -inf, which keeps the shape static and leaves z* unchanged
+            update_vector = torch.where(update_mask.reshape(-1,1,1), action_q_estimates, float("-inf"))
+        self.update_utopian(update_vector.flatten(start_dim=0, end_dim=1))
+        objective_weights = objective_weights.reshape(-1, 1, action_q_estimates.shape[2])
+        return _chebyshev_scalarisation(action_q_estimates, objective_weights, self.z_final)
+
+    def scalarise_actions_batched_stateless(self, action_q_estimates: torch.Tensor, objective_weights: torch.Tensor, update_mask: torch.Tensor = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        '''same as scalarise_actions_batched, but without modifying z*. Returns the scalarised values and the updated z*, 
+        which has to be applied with update_state. This allows the scalarisation to be part of a compiled function'''
+        action_q_estimates = torch.swapaxes(action_q_estimates,1,2)
+        update_vector = action_q_estimates
+        if update_mask is not None:
+            update_vector = torch.where(update_mask.reshape(-1,1,1), action_q_estimates, float("-inf"))
+        z_star = torch.maximum(self.z_star, update_vector.flatten(start_dim=0, end_dim=1).amax(dim=0))
+        objective_weights = objective_weights.reshape(-1, 1, action_q_estimates.shape[2])
+        return _chebyshev_distance(action_q_estimates, objective_weights, z_star + self.threshold), z_star
+
+    def update_state(self, z_star: torch.Tensor) -> None:
+        '''sets z* and z_final in place to the z* returned by scalarise_actions_batched_stateless'''
+        self.z_star.copy_(z_star)
+        torch.add(self.z_star, self.threshold, out=self.z_final)
 
     def update_utopian(self, update_vector: torch.Tensor) -> None:
-        comparison_tensor = torch.vstack([update_vector, self.z_star])
-        self.z_star = torch.max(comparison_tensor, dim=0)[0]
+        '''updates z* and z_final in place with the element-wise maximum of z* and the rows of update_vector'''
+        torch.maximum(self.z_star, update_vector.amax(dim=0), out=self.z_star)
+        torch.add(self.z_star, self.threshold, out=self.z_final)
 
 class LinearScalarisation:
 
     def scalarise_actions(self, action_q_estimates, objective_weights):
-        utility_values = action_q_estimates * objective_weights.reshape(-1,1)
-        utility_values = torch.sum(utility_values, dim=0)
-        
-        return utility_values
+        '''action_q_estimates has the shape (num_objectives, num_actions). The weighted sum over the objectives is a single matrix-vector product'''
+        return objective_weights.to(action_q_estimates.dtype) @ action_q_estimates
+    
+    def scalarise_actions_batched(self, action_q_estimates, objective_weights, update_mask = None):
+        '''scalarises the q estimates of several agents at once. action_q_estimates has the shape (num_agents, num_objectives, num_actions),
+        objective_weights is either shared by all agents or has the shape (num_agents, num_objectives).
+        The returned tensor has the shape (num_agents, num_actions). update_mask is only used by the chebyshev scalarisation'''
+        objective_weights = objective_weights.to(action_q_estimates.dtype).reshape(-1, action_q_estimates.shape[1])
+        return torch.einsum('nqa,nq->na', action_q_estimates, objective_weights.expand(action_q_estimates.shape[0], -1))
+
+    def scalarise_actions_batched_stateless(self, action_q_estimates, objective_weights, update_mask = None):
+        '''the linear scalarisation has no state, so the returned state is None'''
+        return self.scalarise_actions_batched(action_q_estimates, objective_weights), None
+
+    def update_state(self, state):
+        pass
 
 
 class ReplayBuffer:
@@ -58,98 +109,202 @@ class ReplayBuffer:
         self.importance_sampling = importance_sampling
         self.prioritise_crashes = prioritise_crashes
 
-        #initialise replay buffer
-        self.buffer = torch.zeros(size=(self.size, self.observation_space_size*2+self.num_objectives+3),
-                                        device=self.device) # +3 for selected action, termination flag and importance sampling id
+        #initialise replay buffer. The transitions are kept in host memory and only sampled minibatches are moved to the device
+        #observations are stored in half precision to halve the memory footprint and the bytes gathered per sampled minibatch.
+        #They are converted back to float32 when a minibatch is fetched
+        self.observations = np.empty((self.size, self.observation_space_size), dtype=np.float16)
+        self.actions = np.empty(self.size, dtype=np.int64)
+        self.next_observations = np.empty((self.size, self.observation_space_size), dtype=np.float16)
+        self.rewards = np.empty((self.size, self.num_objectives), dtype=np.float32)
+        self.termination_flags = np.empty(self.size, dtype=bool)
+        self.importance_sampling_ids = np.empty(self.size, dtype=np.float32)
+        #sampling weight factor of each transition, 2 for crashes and 1 otherwise. Only maintained if crashes are prioritised. 
+        #It is written with the transition, so that sampling doesn't need to mask the termination flags
+        self.crash_factors = np.empty(self.size, dtype=np.float64)
         
         self.running_index = 0 #keeps track of next index of the replay buffer to be filled
         self.num_elements = 0 #keeps track of the current number of elements in the replay buffer
 
+        #sampled minibatches are packed into one float32 staging buffer with the layout 
+        #[observations, next observations, rewards, action, termination flag, importance sampling id]
+        L, R = self.observation_space_size, self.num_objectives
+        self.staging_width = 2*L + R + 3
+        #column indices of the staging layout, computed once instead of per minibatch
+        self.obs_slice = slice(0, L)
+        self.next_obs_slice = slice(L, 2*L)
+        self.reward_slice = slice(2*L, 2*L+R)
+        self.action_idx = 2*L+R
+        self.termination_idx = 2*L+R+1
+        self.importance_sampling_idx = 2*L+R+2
+        self.staging_buffer = None #pinned and reused on cuda devices
+        self.staging_event = torch.cuda.Event() if self.device.type == "cuda" else None
+        #the minibatches are transferred on a dedicated stream, so that the transfer can overlap with queued computations
+        self.copy_stream = torch.cuda.Stream(self.device) if self.device.type == "cuda" else None
+        self.push_row_buffer = None #device buffer to pack pushed device tensors into, reused as long as the row shape doesn't change
+
     def push(self, obs, action, next_obs, reward, terminated, importance_sampling_id = None, num_samples: int = 1):
         assert num_samples >= 1
-        assert (not self.importance_sampling) or importance_sampling_id != None, "If importance sampling is activated, you need to provide a corresponding identifier"
+        assert (not self.importance_sampling) or importance_sampling_id is not None, "If importance sampling is activated, you need to provide a corresponding identifier"
         if not self.importance_sampling:
-            importance_sampling_id = torch.tensor([0], device=self.device)
-
-        #for single agent environments
-        if num_samples == 1:
-            elem = torch.concatenate([obs.flatten(), action, next_obs.flatten(), reward, terminated, importance_sampling_id])
-            self.buffer[self.running_index] = elem
-            self.__increment_indices()
-
-        else:#for multi-agent environments. All samples must have the same importance_sampling_id
-            for i in range(num_samples):
-                elem = torch.concatenate([obs[i].flatten(), torch.tensor([action[i]], device=self.device), next_obs[i].flatten(), reward[i], 
-                                          torch.tensor([terminated[i]], device=self.device), 
-                                          torch.tensor([importance_sampling_id], device=self.device)])
-                
-                self.buffer[self.running_index] = elem
-                self.__increment_indices()
-
-    def __increment_indices(self):
+            importance_sampling_id = 0
+        #the importance_sampling_id is either shared by all samples or given for each sample
+        importance_sampling_id = np.broadcast_to(_to_numpy(importance_sampling_id).reshape(-1), (num_samples,))
+
+        #write all samples at once into the ring buffer. Single agent environments push one sample, 
+        #multi-agent environments push one sample per controlled vehicle
+        indices = (self.running_index + np.arange(num_samples)) % self.size
+        obs, next_obs, reward = self.__to_host_rows(num_samples, obs, next_obs, reward)
+        self.observations[indices] = obs
+        self.actions[indices] = _to_numpy(action).reshape(num_samples)
+        self.next_observations[indices] = next_obs
+        self.rewards[indices] = reward
+        self.termination_flags[indices] = _to_numpy(terminated).reshape(num_samples)
+        if self.prioritise_crashes:
+            self.crash_factors[indices] = np.where(self.termination_flags[indices], 2.0, 1.0)
+        self.importance_sampling_ids[indices] = importance_sampling_id
+
         #update auxiliary variables
-        self.running_index = (self.running_index + 1) % self.size
-        if self.num_elements < self.size:
-            self.num_elements += 1
+        self.running_index = (self.running_index + num_samples) % self.size
+        self.num_elements = min(self.num_elements + num_samples, self.size)
+
+    def __to_host_rows(self, num_samples, *columns) -> List[np.ndarray]:
+        '''returns the columns as numpy arrays of shape (num_samples, -1). If all of them are device tensors, 
+        they are packed into one persistent device row buffer first, so that they are moved to the host with a single transfer'''
+        if not all(isinstance(column, torch.Tensor) and column.device.type != "cpu" for column in columns):
+            return [_to_numpy(column).reshape(num_samples, -1) for column in columns]
+        
+        columns = [column.detach().reshape(num_samples, -1).to(torch.float32) for column in columns]
+        widths = [column.shape[1] for column in columns]
+        row_shape = (num_samples, sum(widths))
+        if self.push_row_buffer is None or self.push_row_buffer.shape != row_shape or self.push_row_buffer.device != columns[0].device:
+            self.push_row_buffer = torch.empty(row_shape, dtype=torch.float32, device=columns[0].device)
+        torch.cat(columns, dim=1, out=self.push_row_buffer)
+        host_rows = self.push_row_buffer.cpu().numpy()
+        return np.split(host_rows, np.cumsum(widths)[:-1], axis=1)
 
     def sample(self, sample_size):
-        sample_probs = (torch.ones(self.num_elements)/self.num_elements).to(self.device)
+        '''returns the buffer indices of the sampled transitions. Use sample_batch or the get_* methods to fetch the corresponding tensors'''
+        sample_size = max(1,round(sample_size))
+        #uniform sampling doesn't require a probability array
+        if not (self.importance_sampling or self.prioritise_crashes):
+            return self.rng.integers(0, self.num_elements, size=sample_size)
+        
         if self.importance_sampling:
             sample_probs = self.compute_importance_sampling_probs()
+            if self.prioritise_crashes:
+                sample_probs *= self.crash_factors[:self.num_elements]
+        else:
+            sample_probs = self.crash_factors[:self.num_elements]
 
-        if self.prioritise_crashes:
-            crashed_flag = self.buffer[:self.num_elements,-2].to(dtype=torch.bool)
-            #inv_crash_ratio = self.num_elements/torch.sum(crashed_flag)
-            sample_probs[crashed_flag] = sample_probs[crashed_flag] * 2
-
-        #normalise so that the sum of probs is 1
-        sample_probs = sample_probs / torch.cumsum(sample_probs, dim=0)[-1]
-        sample_probs = sample_probs.cpu().numpy() # move to cpu so that it can be used by numpy
-
-        sample_indices = self.rng.choice(self.num_elements, p = sample_probs, size=max(1,round(sample_size)), replace=True, shuffle=True)
-        return self.buffer[sample_indices]
+        #inverse cdf sampling: one cumulative sum and a binary search per sample instead of a scan of the probs per sample.
+        #The probs don't need to be normalised, the uniform samples are scaled by the total instead
+        cdf = np.cumsum(sample_probs)
+        sample_indices = np.searchsorted(cdf, self.rng.random(sample_size) * cdf[-1], side="right")
+        #guards against rounding of the scaled samples onto the total
+        return np.minimum(sample_indices, self.num_elements - 1, out=sample_indices)
     
     def compute_importance_sampling_probs(self):
-        imp_sampling_ids = self.buffer[:self.num_elements,-1]
-        min_id = torch.min(imp_sampling_ids)
+        imp_sampling_ids = self.importance_sampling_ids[:self.num_elements].astype(np.float64)
+        min_id = np.min(imp_sampling_ids)
 
         #the more recent the sample, the higher the probability of being selected
         probs = (imp_sampling_ids - min_id + 1)
         
         return probs
 
+    def __to_device(self, array: np.ndarray) -> torch.Tensor:
+        '''moves a gathered minibatch column to the device'''
+        tensor = torch.from_numpy(array)
+        if self.device.type == "cuda":
+            tensor = tensor.pin_memory()
+        return tensor.to(self.device, non_blocking=True)
+
+    def sample_batch(self, sample_size) -> Dict[str, torch.Tensor]:
+        '''samples a minibatch and moves all of its columns to the device with a single transfer.
+        Returns a dictionary with the same tensors as the corresponding get_* methods'''
+        samples = self.sample(sample_size)
+        num_samples = samples.shape[0]
+
+        staging = self.__get_staging_array(num_samples)
+        staging[:,self.obs_slice] = self.observations[samples]
+        staging[:,self.next_obs_slice] = self.next_observations[samples]
+        staging[:,self.reward_slice] = self.rewards[samples]
+        staging[:,self.action_idx] = self.actions[samples]
+        staging[:,self.termination_idx] = self.termination_flags[samples]
+        staging[:,self.importance_sampling_idx] = self.importance_sampling_ids[samples]
+
+        if self.staging_event is None:
+            batch = torch.from_numpy(staging).to(self.device)
+        else:
+            with torch.cuda.stream(self.copy_stream):
+                batch = self.staging_buffer[:num_samples].to(self.device, non_blocking=True)
+                self.staging_event.record() #the staging buffer must not be overwritten before the transfer has finished
+            torch.cuda.current_stream(self.device).wait_stream(self.copy_stream)
+            batch.record_stream(torch.cuda.current_stream(self.device))
+
+        #the action of each sample is repeated for every objective, of shape (num_samples, num_objectives, 1)
+        actions = batch[:,self.action_idx,None,None].long().expand(-1,self.num_objectives,1).contiguous()
+        return {
+            "observations": batch[:,self.obs_slice],
+            "next_obs": batch[:,self.next_obs_slice],
+            "rewards": batch[:,self.reward_slice],
+            "actions": actions,
+            "termination_flags": batch[:,self.termination_idx].bool(),
+            "importance_sampling_ids": batch[:,self.importance_sampling_idx],
+        }
+    
+    def __get_staging_array(self, num_samples) -> np.ndarray:
+        '''returns a float32 array of shape (num_samples, staging_width) to pack a minibatch into. 
+        On cuda devices this is a view of the persistent pinned staging buffer, which grows if necessary'''
+        if self.staging_event is None:
+            return np.empty((num_samples, self.staging_width), dtype=np.float32)
+        
+        if self.staging_buffer is None or self.staging_buffer.shape[0] < num_samples:
+            capacity = num_samples if self.staging_buffer is None else max(num_samples, 2*self.staging_buffer.shape[0])
+            self.staging_buffer = torch.empty((capacity, self.staging_width), dtype=torch.float32, pin_memory=True)
+        else:
+            self.staging_event.synchronize()
+        return self.staging_buffer.numpy()[:num_samples]
+
     #only to be used when the samples originating from this buffer
     def get_observations(self, samples):
-        return samples[:,:self.observation_space_size]
+        return self.__to_device(self.observations[samples].astype(np.float32))
 
-    def get_actions(self, samples: torch.Tensor):
-        elem = samples[:,self.observation_space_size].to(torch.int64)#.reshape(-1,1,1) #second element was self.num_objectives
-        arr = elem.repeat_interleave(repeats=self.num_objectives)
-        arr = arr.reshape(-1,self.num_objectives,1)
-        return arr
+    def get_actions(self, samples):
+        elem = self.__to_device(self.actions[samples])
+        return elem[:,None,None].expand(-1,self.num_objectives,1).contiguous()
     def get_next_obs(self, samples):
-        return samples[:,self.observation_space_size+1:self.observation_space_size*2+1]
+        return self.__to_device(self.next_observations[samples].astype(np.float32))
 
     def get_rewards(self, samples):
-        return samples[:,self.observation_space_size*2+1:-2]
+        return self.__to_device(self.rewards[samples])
     
     def get_termination_flag(self, samples):
-        return samples[:,-2].flatten().to(torch.bool)
+        return self.__to_device(self.termination_flags[samples])
     
     def get_importance_sampling_id(self, samples):
-        return samples[:,-1].flatten()
+        return self.__to_device(self.importance_sampling_ids[samples])
 
 
 class DataLogger:
-    def __init__(self, loggerName: str, fieldNames: List[str]):
-        self.tupleType = namedtuple(loggerName, fieldNames)
-        self.tuple_list = []
+    '''Stores log entries column-wise in preallocated numpy arrays with a write cursor. The dtype of each column is inferred 
+    from the first entry and promoted if a later entry doesn't fit (e.g. nan values in an integer column).
+    capacity is a hint for the expected number of entries, the columns grow if it is exceeded.'''
+    def __init__(self, loggerName: str, fieldNames: List[str], capacity: int = 1024):
+        self.loggerName = loggerName
+        self.fieldNames = list(fieldNames)
+        self.capacity = max(1, int(capacity))
+        self.columns = None #allocated with the first entry, once the dtypes are known
+        self.num_entries = 0
 
     def _add_by_list(self, entry_list: List):
-        self.tuple_list.append(self.tupleType(*entry_list))
+        self._append(entry_list)
         
     def _add_by_params(self, *args, **kwargs):
-        self.tuple_list.append(self.tupleType(*args, **kwargs))
+        remaining_fields = self.fieldNames[len(args):]
+        assert set(kwargs) <= set(remaining_fields), f"{self.loggerName} got unexpected fields {sorted(set(kwargs) - set(remaining_fields))}"
+        entry = list(args) + [kwargs[name] for name in remaining_fields]
+        self._append(entry)
 
     def add(self, *args, **kwargs):
         if isinstance(args, tuple) and len(args) == 1 and len(kwargs.values()) == 0:
@@ -161,18 +316,122 @@ class DataLogger:
         else:
             self._add_by_params(*args, **kwargs)
 
+    def _append(self, entry):
+        assert len(entry) == len(self.fieldNames), f"{self.loggerName} expects {len(self.fieldNames)} values per entry, got {len(entry)}"
+        if self.columns is None:
+            self.columns = {name: np.empty(self.capacity, dtype=DataLogger._infer_dtype(value)) 
+                            for name, value in zip(self.fieldNames, entry)}
+        elif self.num_entries == self.capacity:
+            self._grow()
+
+        for name, value in zip(self.fieldNames, entry):
+            column = self._promote_column(name, DataLogger._infer_dtype(value))
+            column[self.num_entries] = np.nan if value is None and column.dtype != object else value
+        self.num_entries += 1
+
+    def add_block(self, num_entries: int, **columns):
+        '''appends num_entries entries at once. Numpy arrays provide one value per entry, 
+        any other value (e.g. a list of objective weights) is shared by all entries of the block'''
+        assert set(columns.keys()) == set(self.fieldNames), f"{self.loggerName} expects the columns {self.fieldNames}"
+        if num_entries == 0:
+            return
+        dtypes = {name: value.dtype if isinstance(value, np.ndarray) else DataLogger._infer_dtype(value) for name, value in columns.items()}
+        if self.columns is None:
+            self.capacity = max(self.capacity, num_entries)
+            self.columns = {name: np.empty(self.capacity, dtype=dtypes[name]) for name in self.fieldNames}
+        while self.num_entries + num_entries > self.capacity:
+            self._grow()
+
+        block = slice(self.num_entries, self.num_entries + num_entries)
+        for name, value in columns.items():
+            column = self._promote_column(name, dtypes[name])
+            if isinstance(value, np.ndarray):
+                column[block] = value
+            else:
+                column[block].fill(np.nan if value is None and column.dtype != object else value)
+        self.num_entries += num_entries
+
+    def _promote_column(self, name: str, dtype: np.dtype) -> np.ndarray:
+        '''returns the column, converted to a dtype that can also hold values of the given dtype'''
+        column = self.columns[name]
+        if dtype != column.dtype:
+            promoted_dtype = np.promote_types(column.dtype, dtype)
+            if promoted_dtype != column.dtype:
+                column = self.columns[name] = column.astype(promoted_dtype)
+        return column
+
+    def _grow(self):
+        self.capacity *= 2
+        for name, column in self.columns.items():
+            grown_column = np.empty(self.capacity, dtype=column.dtype)
+            grown_column[:self.num_entries] = column[:self.num_entries]
+            self.columns[name] = grown_column
+
+    @staticmethod
+    def _infer_dtype(value) -> np.dtype:
+        #missing values are stored as nan, so that they are promoted to float like in a dataframe built from a list of entries
+        if value is None:
+            return np.dtype(np.float64)
+        if isinstance(value, (bool, np.bool_)):
+            return np.dtype(bool)
+        if isinstance(value, (int, np.integer)):
+            return np.dtype(np.int64)
+        if isinstance(value, (float, np.floating)):
+            return np.dtype(np.float64)
+        return np.dtype(object)
+
     def to_dataframe(self):
-        return pd.DataFrame(self.tuple_list)
+        '''builds the dataframe from the filled part of the columns. The columns are passed without copying,
+        later entries are written behind the filled part and don't affect a returned dataframe'''
+        if self.columns is None:
+            return pd.DataFrame(columns=self.fieldNames)
+        return pd.DataFrame({name: self.columns[name][:self.num_entries] for name in self.fieldNames}, copy=False)
 
-def random_objective_weights(num_objectives: int, rng: np.random.Generator, device):
-    random_weights = rng.random(num_objectives)
-    random_weights = torch.tensor(random_weights / np.sum(random_weights), device=device) #normalise the random weights
-    return random_weights
+def _to_numpy(x) -> np.ndarray:
+    '''converts tensors, lists of tensors and python values to numpy arrays'''
+    if isinstance(x, torch.Tensor):
+        return x.detach().cpu().numpy()
+    if isinstance(x, (list, tuple)) and len(x) > 0 and isinstance(x[0], torch.Tensor):
+        return torch.stack(x).detach().cpu().numpy()
+    return np.asarray(x)
 
+def random_objective_weights(num_objectives: int, rng: np.random.Generator, device, num_weights: int = None):
+    '''returns a tensor of random objective weights that sum up to 1. The weights are drawn uniformly from the simplex, 
+    which is the dirichlet distribution with all concentration parameters set to 1. If num_weights is given, 
+    a tensor of shape (num_weights, num_objectives) is created with a single transfer to the device'''
+    random_weights = rng.dirichlet(np.ones(num_objectives), size=num_weights)
+    return torch.from_numpy(random_weights).to(device)
+
+
+_reference_directions_cache = {}
+
+def equally_spaced_weights(num_objectives: int, num_points: int, seed: int = None) -> np.ndarray:
+    '''returns equally spaced objective weights according to the riesz s-energy method of pymoo. 
+    The weights are deterministic for a given seed, so they are only computed once per (num_objectives, num_points, seed)'''
+    if seed is None:
+        return get_reference_directions("energy", n_dim = num_objectives, n_points = num_points, seed=seed)
+    
+    key = (num_objectives, num_points, seed)
+    if key not in _reference_directions_cache:
+        _reference_directions_cache[key] = get_reference_directions("energy", n_dim = num_objectives, n_points = num_points, seed=seed)
+    return _reference_directions_cache[key].copy()
 
 def calc_hypervolume(reference_point: np.ndarray = np.array([0,0]), reward_vector: np.ndarray = None):
     '''reference point represents the worst possible value'''
     assert reward_vector is not None, "You have to provide a reward vector!"
     reward_vector = reward_vector * (-1) # convert to minimisation problem
+    if reward_vector.ndim == 2 and reward_vector.shape[1] == 2:
+        return _calc_hypervolume_2d(np.asarray(reference_point, dtype=np.float64), reward_vector.astype(np.float64))
     ind = HV(ref_point=reference_point)
-    return ind(reward_vector)
\ No newline at end of file
+    return ind(reward_vector)
+
+def _calc_hypervolume_2d(reference_point: np.ndarray, points: np.ndarray) -> float:
+    '''exact hypervolume of a set of two dimensional points of a minimisation problem. 
+    Sweeps over the points sorted by their first objective and sums up the area of the resulting vertical slices'''
+    points = points[np.all(points <= reference_point, axis=1)] #only points dominating the reference point contribute
+    if points.shape[0] == 0:
+        return 0.0
+    points = points[np.lexsort((points[:,1], points[:,0]))]
+    best_y = np.minimum.accumulate(points[:,1]) #lowest second objective of all points left of each slice
+    widths = np.append(points[1:,0], reference_point[0]) - points[:,0]
+    return float(np.sum(widths * (reference_point[1] - best_y)))
\ No newline at end of file